@@ -8,7 +8,10 @@
 
 
 from PyQt5 import QtCore, QtGui, QtWidgets
-from draw import FilterHandler, BlurHandler, default_image
+from lazy import lazy_import
+
+draw = lazy_import('draw')
+export = lazy_import('export')
 
 
 class ClickableLabel(QtWidgets.QLabel):
@@ -22,6 +25,96 @@ class ClickableLabel(QtWidgets.QLabel):
         QtWidgets.QLabel.mousePressEvent(self, event)
 
 
+class HistogramWidget(QtWidgets.QWidget):
+    """Гистограммы R, G, B и яркости, counts - массив (4, 256)"""
+    COLORS = (QtGui.QColor(220, 50, 50), QtGui.QColor(50, 170, 50), QtGui.QColor(50, 80, 220))
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.counts = None
+
+    def set_counts(self, counts):
+        self.counts = counts
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtGui.QColor(40, 40, 40))
+        if self.counts is None:
+            return
+        # Крайние уровни часто выбиваются из-за пересветов и не должны сплющивать остальное
+        peak = max(self.counts[:, 1:-1].max(), 1)
+        width, height = self.width(), self.height()
+
+        def polygon(channel):
+            points = [QtCore.QPointF(0, height)]
+            for level in range(256):
+                value = min(channel[level] / peak, 1)
+                points.append(QtCore.QPointF(level * width / 255, height - value * height))
+            points.append(QtCore.QPointF(width, height))
+            return QtGui.QPolygonF(points)
+
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.setBrush(QtGui.QColor(160, 160, 160))
+        painter.drawPolygon(polygon(self.counts[3]))
+        painter.setBrush(QtCore.Qt.NoBrush)
+        for color, channel in zip(self.COLORS, self.counts[:3]):
+            painter.setPen(color)
+            painter.drawPolyline(polygon(channel))
+
+
+class ExportDialog(QtWidgets.QDialog):
+    """Варианты экспорта: строка на вариант с размером, форматом и параметрами кодировщика"""
+    FORMATS = ('JPEG', 'PNG', 'WEBP')
+    HEADERS = ('', 'Большая сторона', 'Формат', 'Качество', 'Прогрессивный', 'Оптимизация', 'Сжатие PNG',
+               'Без потерь')
+
+    def __init__(self, parent, variants, names):
+        super().__init__(parent)
+        self.setWindowTitle('Сохранить')
+        self.suffixes = [variant.suffix for variant in variants]
+        self.rows = []
+        layout = QtWidgets.QGridLayout(self)
+        for column, text in enumerate(self.HEADERS):
+            layout.addWidget(QtWidgets.QLabel(text, self), 0, column)
+        for row, (variant, name) in enumerate(zip(variants, names), 1):
+            widgets = {'enabled': QtWidgets.QCheckBox(name, self), 'side': QtWidgets.QSpinBox(self),
+                       'format': QtWidgets.QComboBox(self), 'quality': QtWidgets.QSpinBox(self),
+                       'progressive': QtWidgets.QCheckBox(self), 'optimize': QtWidgets.QCheckBox(self),
+                       'compress_level': QtWidgets.QSpinBox(self), 'lossless': QtWidgets.QCheckBox(self)}
+            widgets['enabled'].setChecked(row == 1)
+            widgets['side'].setRange(0, 100000)
+            widgets['side'].setSpecialValueText('Полный размер')
+            widgets['side'].setValue(variant.side or 0)
+            widgets['format'].addItem('По расширению', None)
+            for image_format in self.FORMATS:
+                widgets['format'].addItem(image_format, image_format)
+            widgets['format'].setCurrentIndex(widgets['format'].findData(variant.format))
+            widgets['quality'].setRange(1, 100)
+            widgets['quality'].setValue(variant.quality)
+            widgets['progressive'].setChecked(variant.progressive)
+            widgets['optimize'].setChecked(variant.optimize)
+            widgets['compress_level'].setRange(0, 9)
+            widgets['compress_level'].setValue(variant.compress_level)
+            widgets['lossless'].setChecked(variant.lossless)
+            for column, widget in enumerate(widgets.values()):
+                layout.addWidget(widget, row, column)
+            self.rows.append(widgets)
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel, self)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons, len(self.rows) + 1, 0, 1, len(self.HEADERS))
+
+    def variants(self):
+        """Отмеченные варианты"""
+        return [export.Variant(suffix, widgets['side'].value() or None, widgets['format'].currentData(),
+                               widgets['quality'].value(), widgets['progressive'].isChecked(),
+                               widgets['optimize'].isChecked(), widgets['compress_level'].value(),
+                               widgets['lossless'].isChecked())
+                for suffix, widgets in zip(self.suffixes, self.rows) if widgets['enabled'].isChecked()]
+
+
 class Ui_MainWindow(object):
     def setupUi(self, MainWindow):
         MainWindow.setObjectName("MainWindow")
@@ -36,8 +129,71 @@ class Ui_MainWindow(object):
         self.image_label.setText("")
         self.image_label.setAlignment(QtCore.Qt.AlignCenter)
         self.image_label.setObjectName("image_label")
-        self.verticalLayout_6.addWidget(self.image_label)
+        self.horizontalLayout_image = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_image.setObjectName("horizontalLayout_image")
+        self.horizontalLayout_image.addWidget(self.image_label, 1)
+        self.histogram_widget = HistogramWidget(self.centralwidget)
+        self.histogram_widget.setFixedSize(QtCore.QSize(200, 120))
+        self.histogram_widget.setObjectName("histogram_widget")
+        self.horizontalLayout_image.addWidget(self.histogram_widget, 0, QtCore.Qt.AlignTop)
+        self.verticalLayout_6.addLayout(self.horizontalLayout_image)
+
+        # Вкладки строятся в setupTabs
+        self.menu_tab = None
+
+        MainWindow.setCentralWidget(self.centralwidget)
+        self.menubar = QtWidgets.QMenuBar(MainWindow)
+        self.menubar.setGeometry(QtCore.QRect(0, 0, 609, 21))
+        self.menubar.setObjectName("menubar")
+        self.menuFile = QtWidgets.QMenu(self.menubar)
+        self.menuFile.setObjectName("menuFile")
+        self.menuEdit = QtWidgets.QMenu(self.menubar)
+        self.menuEdit.setObjectName("menuEdit")
+        MainWindow.setMenuBar(self.menubar)
+        self.statusbar = QtWidgets.QStatusBar(MainWindow)
+        self.statusbar.setObjectName("statusbar")
+        MainWindow.setStatusBar(self.statusbar)
+        self.export_progress = QtWidgets.QProgressBar(self.statusbar)
+        self.export_progress.setMaximumWidth(250)
+        self.export_progress.setObjectName("export_progress")
+        self.export_progress.hide()
+        self.statusbar.addPermanentWidget(self.export_progress)
+        self.export_cancel_button = QtWidgets.QPushButton(self.statusbar)
+        self.export_cancel_button.setObjectName("export_cancel_button")
+        self.export_cancel_button.hide()
+        self.statusbar.addPermanentWidget(self.export_cancel_button)
+        self.actionOpen = QtWidgets.QAction(MainWindow)
+        self.actionOpen.setObjectName("actionOpen")
+        self.actionSave = QtWidgets.QAction(MainWindow)
+        self.actionSave.setObjectName("actionSave")
+        self.actionAddFilter = QtWidgets.QAction(MainWindow)
+        self.actionAddFilter.setObjectName("actionAddFilter")
+        self.actionLoadCube = QtWidgets.QAction(MainWindow)
+        self.actionLoadCube.setObjectName("actionLoadCube")
+        self.actionSaveCube = QtWidgets.QAction(MainWindow)
+        self.actionSaveCube.setObjectName("actionSaveCube")
+        self.actionReset = QtWidgets.QAction(MainWindow)
+        self.actionReset.setObjectName("actionReset")
+        self.actionUndo = QtWidgets.QAction(MainWindow)
+        self.actionUndo.setObjectName("actionUndo")
+        self.actionRedo = QtWidgets.QAction(MainWindow)
+        self.actionRedo.setObjectName("actionRedo")
+        self.menuFile.addAction(self.actionOpen)
+        self.menuFile.addAction(self.actionSave)
+        self.menuEdit.addAction(self.actionUndo)
+        self.menuEdit.addAction(self.actionRedo)
+        self.menuEdit.addAction(self.actionAddFilter)
+        self.menuEdit.addAction(self.actionLoadCube)
+        self.menuEdit.addAction(self.actionSaveCube)
+        self.menuEdit.addAction(self.actionReset)
+        self.menubar.addAction(self.menuFile.menuAction())
+        self.menubar.addAction(self.menuEdit.menuAction())
+
+        self.retranslateUi(MainWindow)
+        QtCore.QMetaObject.connectSlotsByName(MainWindow)
 
+    def setupTabs(self):
+        """Панель вкладок под изображением"""
         self.menu_tab = QtWidgets.QTabWidget(self.centralwidget)
         self.menu_tab.setFocusPolicy(QtCore.Qt.NoFocus)
         self.menu_tab.setElideMode(QtCore.Qt.ElideNone)
@@ -77,6 +233,17 @@ class Ui_MainWindow(object):
         self.sharpness_slider.setOrientation(QtCore.Qt.Horizontal)
         self.sharpness_slider.setObjectName("sharpness_slider")
         self.verticalLayout_7.addWidget(self.sharpness_slider)
+        self.horizontalLayout_auto = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_auto.setObjectName("horizontalLayout_auto")
+        self.auto_levels_button = QtWidgets.QPushButton(self.adjusting_tab)
+        self.auto_levels_button.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.auto_levels_button.setObjectName("auto_levels_button")
+        self.horizontalLayout_auto.addWidget(self.auto_levels_button)
+        self.auto_white_button = QtWidgets.QPushButton(self.adjusting_tab)
+        self.auto_white_button.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.auto_white_button.setObjectName("auto_white_button")
+        self.horizontalLayout_auto.addWidget(self.auto_white_button)
+        self.verticalLayout_7.addLayout(self.horizontalLayout_auto)
         self.menu_tab.addTab(self.adjusting_tab, "")
 
         self.crop_tab = QtWidgets.QWidget()
@@ -169,7 +336,7 @@ class Ui_MainWindow(object):
         self.default_fliter_label.setStyleSheet("border: 1px solid blue")
         self.default_fliter_label.setText("")
         self.default_fliter_label.setObjectName("default_fliter_label")
-        self.default_fliter_label.func = default_image
+        self.default_fliter_label.func = draw.default_image
         self.default_fliter_label.flag = False
         self.default_fliter_label.name = 'По_умолчанию'
         self.horizontalLayout_4.addWidget(self.default_fliter_label)
@@ -178,7 +345,7 @@ class Ui_MainWindow(object):
         self.black_white_filter_label.setStyleSheet("border: 1px solid gray")
         self.black_white_filter_label.setText("")
         self.black_white_filter_label.setObjectName("black_white_filter_label")
-        self.black_white_filter_label.func = FilterHandler.black_white
+        self.black_white_filter_label.func = draw.FilterHandler.black_white
         self.black_white_filter_label.flag = False
         self.black_white_filter_label.name = 'Черно-белый'
         self.horizontalLayout_4.addWidget(self.black_white_filter_label)
@@ -187,7 +354,7 @@ class Ui_MainWindow(object):
         self.negative_filter_label.setStyleSheet("border: 1px solid gray")
         self.negative_filter_label.setText("")
         self.negative_filter_label.setObjectName("negative_filter_label")
-        self.negative_filter_label.func = FilterHandler.negative
+        self.negative_filter_label.func = draw.FilterHandler.negative
         self.negative_filter_label.flag = False
         self.negative_filter_label.name = 'Негатив'
         self.horizontalLayout_4.addWidget(self.negative_filter_label)
@@ -196,7 +363,7 @@ class Ui_MainWindow(object):
         self.sepia_filter_label.setStyleSheet("border: 1px solid gray")
         self.sepia_filter_label.setText("")
         self.sepia_filter_label.setObjectName("sepia_filter_label")
-        self.sepia_filter_label.func = FilterHandler.sepia
+        self.sepia_filter_label.func = draw.FilterHandler.sepia
         self.sepia_filter_label.flag = False
         self.sepia_filter_label.name = 'Сепия'
         self.horizontalLayout_4.addWidget(self.sepia_filter_label)
@@ -212,7 +379,7 @@ class Ui_MainWindow(object):
         self.default_blur_label.setStyleSheet("border: 1px solid blue")
         self.default_blur_label.setText("")
         self.default_blur_label.setObjectName("default_blur_label")
-        self.default_blur_label.func = default_image
+        self.default_blur_label.func = draw.default_image
         self.default_blur_label.flag = False
         self.default_blur_label.name = 'По_умолчанию'
         self.horizontalLayout_3.addWidget(self.default_blur_label)
@@ -222,7 +389,7 @@ class Ui_MainWindow(object):
         self.vertical_blur_label.setStyleSheet("border: 1px solid gray")
         self.vertical_blur_label.setText("")
         self.vertical_blur_label.setObjectName("vertical_blur_label")
-        self.vertical_blur_label.func = BlurHandler.vertical_blur
+        self.vertical_blur_label.func = draw.BlurHandler.vertical_blur
         self.vertical_blur_label.flag = False
         self.vertical_blur_label.name = 'Вертикальное размытие'
         self.horizontalLayout_3.addWidget(self.vertical_blur_label)
@@ -232,46 +399,13 @@ class Ui_MainWindow(object):
         self.horizontal_blur_label.setStyleSheet("border: 1px solid gray")
         self.horizontal_blur_label.setText("")
         self.horizontal_blur_label.setObjectName("horizontal_blur_label")
-        self.horizontal_blur_label.func = BlurHandler.horizontal_blur
+        self.horizontal_blur_label.func = draw.BlurHandler.horizontal_blur
         self.horizontal_blur_label.flag = False
         self.horizontal_blur_label.name = 'Горизонтальное размытие'
         self.horizontalLayout_3.addWidget(self.horizontal_blur_label)
         self.menu_tab.addTab(self.blur_tab, "")
         self.verticalLayout_6.addWidget(self.menu_tab)
 
-        MainWindow.setCentralWidget(self.centralwidget)
-        self.menubar = QtWidgets.QMenuBar(MainWindow)
-        self.menubar.setGeometry(QtCore.QRect(0, 0, 609, 21))
-        self.menubar.setObjectName("menubar")
-        self.menuFile = QtWidgets.QMenu(self.menubar)
-        self.menuFile.setObjectName("menuFile")
-        self.menuEdit = QtWidgets.QMenu(self.menubar)
-        self.menuEdit.setObjectName("menuEdit")
-        MainWindow.setMenuBar(self.menubar)
-        self.statusbar = QtWidgets.QStatusBar(MainWindow)
-        self.statusbar.setObjectName("statusbar")
-        MainWindow.setStatusBar(self.statusbar)
-        self.actionOpen = QtWidgets.QAction(MainWindow)
-        self.actionOpen.setObjectName("actionOpen")
-        self.actionSave = QtWidgets.QAction(MainWindow)
-        self.actionSave.setObjectName("actionSave")
-        self.actionAddFilter = QtWidgets.QAction(MainWindow)
-        self.actionAddFilter.setObjectName("actionAddFilter")
-        self.actionReset = QtWidgets.QAction(MainWindow)
-        self.actionReset.setObjectName("actionReset")
-        self.actionUndo = QtWidgets.QAction(MainWindow)
-        self.actionUndo.setObjectName("actionUndo")
-        self.actionRedo = QtWidgets.QAction(MainWindow)
-        self.actionRedo.setObjectName("actionRedo")
-        self.menuFile.addAction(self.actionOpen)
-        self.menuFile.addAction(self.actionSave)
-        self.menuEdit.addAction(self.actionUndo)
-        self.menuEdit.addAction(self.actionRedo)
-        self.menuEdit.addAction(self.actionAddFilter)
-        self.menuEdit.addAction(self.actionReset)
-        self.menubar.addAction(self.menuFile.menuAction())
-        self.menubar.addAction(self.menuEdit.menuAction())
-
         self.crop_sliders = [self.crop_left_slider, self.crop_right_slider, self.crop_top_slider,
                         self.crop_bottom_slider]
         self.adjusting_sliders = [self.brightness_slider, self.contrast_slider, self.sharpness_slider]
@@ -279,16 +413,36 @@ class Ui_MainWindow(object):
                               self.sepia_filter_label, self.negative_filter_label, self.black_white_filter_label]
         self.blur_labels = [self.default_blur_label, self.vertical_blur_label, self.horizontal_blur_label]
 
-        self.retranslateUi(MainWindow)
+        self.retranslateTabs()
         self.menu_tab.setCurrentIndex(0)
-        QtCore.QMetaObject.connectSlotsByName(MainWindow)
 
     def retranslateUi(self, MainWindow):
         _translate = QtCore.QCoreApplication.translate
         MainWindow.setWindowTitle(_translate("MainWindow", "Simple Photo Editor"))
+        self.export_cancel_button.setText(_translate("MainWindow", "Отменить экспорт"))
+        self.menuFile.setTitle(_translate("MainWindow", "Файл"))
+        self.menuEdit.setTitle(_translate("MainWindow", "Правка"))
+        self.actionOpen.setText(_translate("MainWindow", "Открыть"))
+        self.actionOpen.setShortcut(_translate("MainWindow", "Ctrl+O"))
+        self.actionSave.setText(_translate("MainWindow", "Сохранить"))
+        self.actionSave.setShortcut(_translate("MainWindow", "Ctrl+S"))
+        self.actionAddFilter.setText(_translate("MainWindow", "Добавить фильтр"))
+        self.actionLoadCube.setText(_translate("MainWindow", "Добавить фильтр из .cube"))
+        self.actionSaveCube.setText(_translate("MainWindow", "Сохранить цвет в .cube"))
+        self.actionReset.setText(_translate("MainWindow", "Сброс"))
+        self.actionReset.setShortcut(_translate("MainWindow", "Ctrl+R"))
+        self.actionUndo.setText(_translate("MainWindow", "Шаг назад"))
+        self.actionUndo.setShortcut(_translate("MainWindow", "Ctrl+Z"))
+        self.actionRedo.setText(_translate("MainWindow", "Шаг вперед"))
+        self.actionRedo.setShortcut(_translate("MainWindow", "Ctrl+Shift+Z"))
+
+    def retranslateTabs(self):
+        _translate = QtCore.QCoreApplication.translate
         self.brightness_label.setText(_translate("MainWindow", "Яркость"))
         self.contrast_label.setText(_translate("MainWindow", "Контраст"))
         self.sharpness_label.setText(_translate("MainWindow", "Резкость"))
+        self.auto_levels_button.setText(_translate("MainWindow", "Авто уровни"))
+        self.auto_white_button.setText(_translate("MainWindow", "Авто баланс белого"))
         self.menu_tab.setTabText(self.menu_tab.indexOf(self.adjusting_tab), _translate("MainWindow", "Регулировка"))
         self.crop_top_label.setText(_translate("MainWindow", "Верхняя сторона:"))
         self.crop_bottom_label.setText(_translate("MainWindow", "Нижняя сторона:"))
@@ -302,19 +456,6 @@ class Ui_MainWindow(object):
         self.menu_tab.setTabText(self.menu_tab.indexOf(self.rotate_tab), _translate("MainWindow", "Повернуть"))
         self.menu_tab.setTabText(self.menu_tab.indexOf(self.filters_tab), _translate("MainWindow", "Фильтры"))
         self.menu_tab.setTabText(self.menu_tab.indexOf(self.blur_tab), _translate("MainWindow", "Размытие"))
-        self.menuFile.setTitle(_translate("MainWindow", "Файл"))
-        self.menuEdit.setTitle(_translate("MainWindow", "Правка"))
-        self.actionOpen.setText(_translate("MainWindow", "Открыть"))
-        self.actionOpen.setShortcut(_translate("MainWindow", "Ctrl+O"))
-        self.actionSave.setText(_translate("MainWindow", "Сохранить"))
-        self.actionSave.setShortcut(_translate("MainWindow", "Ctrl+S"))
-        self.actionAddFilter.setText(_translate("MainWindow", "Добавить фильтр"))
-        self.actionReset.setText(_translate("MainWindow", "Сброс"))
-        self.actionReset.setShortcut(_translate("MainWindow", "Ctrl+R"))
-        self.actionUndo.setText(_translate("MainWindow", "Шаг назад"))
-        self.actionUndo.setShortcut(_translate("MainWindow", "Ctrl+Z"))
-        self.actionRedo.setText(_translate("MainWindow", "Шаг вперед"))
-        self.actionRedo.setShortcut(_translate("MainWindow", "Ctrl+Shift+Z"))
 
     def add_filter_label(self, func):
         exec(f'self.{func.__name__}_label = ClickableLabel(self.filters_tab)')
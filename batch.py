@@ -0,0 +1,118 @@
+"""Пакетная обработка: применяет один набор правок ко всем изображениям каталога.
+
+    python batch.py SOURCE_DIR TARGET_DIR --recipe recipe.json
+    python batch.py SOURCE_DIR TARGET_DIR --history photo.jpg [--db edit_history.db]
+
+Рецепт - JSON с полями RECORD_FIELDS из pipeline.py, --history берет последнее
+состояние изображения photo.jpg из истории редактора. Qt не требуется."""
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool, cpu_count
+
+from history import DATABASE, read_latest
+from kernels import plugin_filters
+from lut import load_cube
+from pipeline import EditState, FILTERS, load_image
+import stream
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.ppm', '.tif', '.tiff')
+
+filters = FILTERS
+
+
+def read_recipe(filename):
+    with open(filename, encoding='utf-8') as file:
+        return EditState.from_record(json.load(file))
+
+
+def read_history(filename, database=DATABASE):
+    """Последнее сохраненное состояние изображения filename из истории редактора"""
+    record = read_latest(filename, database)
+    if record is None:
+        raise ValueError(f'В истории нет записей для {filename}')
+    return EditState.from_record(record)
+
+
+def load_plugins(modules):
+    """Фильтры из модулей и файлов .cube, как при добавлении фильтра в редакторе"""
+    result = dict(FILTERS)
+    for name in modules:
+        if name.lower().endswith('.cube'):
+            func = load_cube(name)
+            result[func.__name__] = func
+            continue
+        module = importlib.import_module(name)
+        for func_name, func in plugin_filters(module):
+            result[func_name] = func
+    return result
+
+
+def init_worker(plugins):
+    global filters
+    filters = load_plugins(plugins)
+
+
+def process(job):
+    """Обрабатывает один файл, ошибка не прерывает остальные файлы"""
+    source, target, state = job
+    start = time.perf_counter()
+    try:
+        width, height = stream.source_size(source)
+        pixels = width * height
+        if pixels > stream.STREAM_PIXELS and stream.supports(target, filters.get(state.filter)):
+            stream.render_file(source, target, state, filters)
+        else:
+            image = stream.render_image(load_image(source), state, filters)
+            if image.mode == 'RGBA' and target.lower().endswith(('.jpg', '.jpeg')):
+                image = image.convert('RGB')
+            image.save(target)
+    except Exception as error:
+        return source, 0, time.perf_counter() - start, f'{type(error).__name__}: {error}'
+    return source, pixels, time.perf_counter() - start, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Применяет набор правок ко всем изображениям каталога')
+    parser.add_argument('source', help='каталог с изображениями')
+    parser.add_argument('target', help='каталог для результатов')
+    recipe = parser.add_mutually_exclusive_group(required=True)
+    recipe.add_argument('--recipe', help='JSON с параметрами редактирования')
+    recipe.add_argument('--history', help='путь к изображению, открывавшемуся в редакторе')
+    parser.add_argument('--db', default=DATABASE, help='файл истории редактора')
+    parser.add_argument('--format', help='расширение результатов, например png; по умолчанию как у исходного')
+    parser.add_argument('--plugin', action='append', default=[], help='модуль с дополнительными фильтрами или файл .cube')
+    parser.add_argument('--workers', type=int, default=cpu_count(), help='число процессов')
+    args = parser.parse_args(argv)
+
+    state = read_recipe(args.recipe) if args.recipe else read_history(args.history, args.db)
+    os.makedirs(args.target, exist_ok=True)
+    jobs = []
+    for name in sorted(os.listdir(args.source)):
+        stem, extension = os.path.splitext(name)
+        if extension.lower() in IMAGE_EXTENSIONS:
+            extension = f'.{args.format.lstrip(".")}' if args.format else extension
+            jobs.append((os.path.join(args.source, name), os.path.join(args.target, stem + extension), state))
+
+    failed = 0
+    pixels = 0
+    start = time.perf_counter()
+    with Pool(args.workers, initializer=init_worker, initargs=(args.plugin,)) as pool:
+        for done, (source, count, seconds, error) in enumerate(pool.imap_unordered(process, jobs), 1):
+            if error is None:
+                pixels += count
+                print(f'[{done}/{len(jobs)}] {source}: {seconds:.2f} с')
+            else:
+                failed += 1
+                print(f'[{done}/{len(jobs)}] {source}: ошибка {error}', file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    print(f'Готово: {len(jobs) - failed} из {len(jobs)}, ошибок {failed}, {elapsed:.2f} с, '
+          f'{len(jobs) / elapsed if elapsed else 0:.2f} изобр./с, {pixels / 1e6 / elapsed if elapsed else 0:.1f} Мп/с')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,306 @@
+"""Замеры производительности обработчиков draw.py, фильтров filter.py и loop_filter.py и конвейера update_image.
+
+    python bench.py --save benchmark.json
+    python bench.py --compare benchmark.json [--threshold 0.2]
+    python bench.py --sizes thumbnail 1080p --only Blur
+    python bench.py --startup
+
+--startup замеряет только запуск редактора: время до первой отрисовки окна.
+
+Для каждой операции записываются лучшее время из нескольких запусков и пиковый прирост
+памяти процесса (RSS, опрашивается в отдельном потоке). В режиме --compare результаты
+сравниваются с сохраненными, рост времени или памяти больше чем на threshold считается
+регрессией, и код возврата равен 1."""
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import PIL
+from PIL import Image
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+import filter as plugin
+import loop_filter
+from draw import TransposeHandler, AdjustmentHandler, FilterHandler, BlurHandler
+from kernels import plugin_filters
+from lut import LutFilter, bake
+from pipeline import EditState, StageCache, render
+from processes import ProcessFilter
+
+SIZES = {'thumbnail': (160, 120),
+         '1080p': (1920, 1080),
+         '24mp': (6000, 4000),
+         '100mp': (12240, 8160)}
+# Размер image_label, под который вписывается предпросмотр
+PREVIEW_SIZE = (800, 600)
+CROP = {'left': 10, 'right': 5, 'top': 0, 'bottom': 15}
+STATE = EditState(rotation=90, horizontal_flip=True, brightness=60, contrast=70, sharpness=80, crop=CROP,
+                  filter='Сепия', blur='Горизонтальное размытие')
+# Сколько пикселей суммарно обрабатывается повторами одной операции
+REPEAT_PIXELS = 20_000_000
+MAX_REPEAT = 20
+THRESHOLD = 0.2
+# Рост времени и памяти меньше этого не считается регрессией
+TIME_SLACK = 0.002
+MEMORY_SLACK = 2 * 1024 * 1024
+STARTUP_REPEAT = 5
+# Выполняется в отдельном процессе: печатает время импорта main и время до первой отрисовки окна
+STARTUP_SCRIPT = """
+import sys
+import time
+start = time.perf_counter()
+from PyQt5.QtCore import QEvent, QObject
+from PyQt5.QtWidgets import QApplication
+
+
+class FirstPaint(QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint:
+            app.removeEventFilter(self)
+            print(imported - before, time.perf_counter() - start, flush=True)
+            app.quit()
+        return False
+
+
+app = QApplication(sys.argv)
+first_paint = FirstPaint()
+app.installEventFilter(first_paint)
+before = time.perf_counter()
+import main
+imported = time.perf_counter()
+window = main.PhotoEditorApp()
+app.exec()
+"""
+
+
+def synthetic_image(width, height, seed=0):
+    """Градиент с шумом, чтобы сжатие и таблицы работали как на фотографии"""
+    rows = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    columns = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    noise = np.random.default_rng(seed).integers(0, 32, (height, width, 3), np.uint8)
+    pixels = np.empty((height, width, 3), np.uint8)
+    pixels[..., 0] = rows * 0.8
+    pixels[..., 1] = columns * 0.8
+    pixels[..., 2] = (rows + columns) * 0.4
+    pixels += noise
+    return Image.fromarray(pixels)
+
+
+def cases(image):
+    """Пары (название, функция без аргументов) для изображения image"""
+    width, height = image.size
+    result = [
+        ('TransposeHandler.resize', lambda: TransposeHandler.resize(image, width // 2, height // 2)),
+        ('TransposeHandler.fit', lambda: TransposeHandler.fit(image, *PREVIEW_SIZE)),
+        ('TransposeHandler.geometry', lambda: TransposeHandler.geometry(image, CROP, 90, True, False)),
+        ('TransposeHandler.geometry_angle', lambda: TransposeHandler.geometry(image, CROP, 15, False, False)),
+        ('TransposeHandler.rotate', lambda: TransposeHandler.rotate(image, 90)),
+        ('TransposeHandler.horizontal_flip', lambda: TransposeHandler.horizontal_flip(image)),
+        ('TransposeHandler.vertical_flip', lambda: TransposeHandler.vertical_flip(image)),
+        ('TransposeHandler.crop', lambda: TransposeHandler.crop(image, 'left', 10)),
+        ('AdjustmentHandler.brightness', lambda: AdjustmentHandler.brightness(image, 60)),
+        ('AdjustmentHandler.contrast', lambda: AdjustmentHandler.contrast(image, 70)),
+        ('AdjustmentHandler.sharpness', lambda: AdjustmentHandler.sharpness(image, 80)),
+        ('AdjustmentHandler.adjust', lambda: AdjustmentHandler.adjust(image, 60, 70, 80)),
+        ('FilterHandler.black_white', lambda: FilterHandler.black_white(image)),
+        ('FilterHandler.sepia', lambda: FilterHandler.sepia(image)),
+        ('FilterHandler.negative', lambda: FilterHandler.negative(image)),
+        ('BlurHandler.horizontal_blur', lambda: BlurHandler.horizontal_blur(image)),
+        ('BlurHandler.vertical_blur', lambda: BlurHandler.vertical_blur(image)),
+    ]
+    for name, func in plugin_filters(plugin):
+        result.append((f'filter.{name}', lambda func=func: func(image)))
+    # Фильтры filter.py вызывают Image.point и слишком быстры для пула, его показывает цикл на Python
+    for name, func in plugin_filters(loop_filter):
+        result.append((f'loop_filter.{name}', lambda func=func: func(image)))
+        process_filter = ProcessFilter(func)
+        result.append((f'ProcessFilter.{name}', lambda func=process_filter: func(image)))
+    sepia = LutFilter(bake(None, FilterHandler.sepia), 'sepia')
+    result.append(('LutFilter', lambda: sepia(image)))
+    # Повторная отрисовка того же состояния, как при перерисовке окна, берется из кэша этапов
+    cache = StageCache()
+    render(image, STATE, fit=PREVIEW_SIZE, cache=cache)
+    result += [
+        ('pipeline.preview', lambda: render(image, STATE, fit=PREVIEW_SIZE)),
+        ('pipeline.preview_cached', lambda: render(image, STATE, fit=PREVIEW_SIZE, cache=cache)),
+        ('pipeline.export', lambda: render(image, STATE)),
+    ]
+    return result
+
+
+def rss():
+    """Текущий размер резидентной памяти процесса в байтах или None, если узнать его нельзя"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def release_freed_memory():
+    """Просит glibc отдавать большие блоки системе сразу после освобождения,
+    иначе память, освобожденная одной операцией, скрывает рост RSS у следующей"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        # M_MMAP_THRESHOLD = -3: фиксированный порог отключает его автоматический рост
+        libc.mallopt(-3, 128 * 1024)
+    except (OSError, AttributeError, TypeError):
+        pass
+
+
+class MemorySampler(threading.Thread):
+    """Опрашивает RSS, пока выполняется операция, и запоминает максимум"""
+
+    def __init__(self, interval=0.001):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.start_rss = self.peak = rss()
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, rss())
+
+    def stop(self):
+        self.done.set()
+        self.join()
+        self.peak = max(self.peak, rss())
+        return self.peak - self.start_rss
+
+
+def measure(func, repeat):
+    """Лучшее время из repeat запусков и пиковый прирост памяти за первый запуск"""
+    times = []
+    peak = None
+    for run in range(repeat):
+        sampler = MemorySampler() if run == 0 and rss() is not None else None
+        if sampler is not None:
+            sampler.start()
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+        if sampler is not None:
+            peak = sampler.stop()
+        del result
+    return {'seconds': min(times), 'peak_bytes': peak}
+
+
+def run(sizes, only=None, repeat=None):
+    results = {}
+    for size in sizes:
+        width, height = SIZES[size]
+        image = synthetic_image(width, height)
+        count = repeat or max(1, min(MAX_REPEAT, REPEAT_PIXELS // (width * height)))
+        results[size] = {}
+        for name, func in cases(image):
+            if only and not any(part in name for part in only):
+                continue
+            result = results[size][name] = measure(func, count)
+            print(f'{size:>9} {name:<40} {result["seconds"] * 1000:10.2f} мс {_megabytes(result["peak_bytes"])}')
+        del image
+    return results
+
+
+def startup(repeat=STARTUP_REPEAT):
+    """Медианы по repeat запускам редактора, каждый в новом процессе, чтобы модули загружались заново:
+    time_to_window - от запуска интерпретатора до первой отрисовки окна,
+    import_main - импорт main, first_paint - от начала скрипта до первой отрисовки"""
+    env = dict(os.environ)
+    if sys.platform.startswith('linux') and not env.get('DISPLAY') and not env.get('WAYLAND_DISPLAY'):
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-c', STARTUP_SCRIPT], env=env, stdout=subprocess.PIPE, text=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        line = process.stdout.readline()
+        elapsed = time.perf_counter() - start
+        process.communicate()
+        if not line:
+            raise RuntimeError('Редактор завершился, не показав окно')
+        runs.append([elapsed] + [float(value) for value in line.split()])
+    results = {}
+    for index, name in enumerate(('time_to_window', 'import_main', 'first_paint')):
+        result = results[name] = {'seconds': statistics.median(run[index] for run in runs), 'peak_bytes': None}
+        print(f'{"startup":>9} {name:<40} {result["seconds"] * 1000:10.2f} мс {_megabytes(None)}')
+    return results
+
+
+def compare(baseline, results, threshold=THRESHOLD):
+    """Список регрессий: (размер, операция, что выросло, было, стало)"""
+    regressions = []
+    for size, operations in results.items():
+        for name, result in operations.items():
+            old = baseline.get(size, {}).get(name)
+            if old is None:
+                continue
+            if result['seconds'] > old['seconds'] * (1 + threshold) + TIME_SLACK:
+                regressions.append((size, name, 'seconds', old['seconds'], result['seconds']))
+            if (result['peak_bytes'] is not None and old['peak_bytes'] is not None
+                    and result['peak_bytes'] > old['peak_bytes'] * (1 + threshold) + MEMORY_SLACK):
+                regressions.append((size, name, 'peak_bytes', old['peak_bytes'], result['peak_bytes']))
+    return regressions
+
+
+def environment():
+    return {'python': platform.python_version(), 'pillow': PIL.__version__, 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def _megabytes(size):
+    return '       ? МБ' if size is None else f'{size / 1024 / 1024:8.1f} МБ'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Замеры производительности редактора')
+    parser.add_argument('--sizes', nargs='+', choices=SIZES, default=list(SIZES), help='размеры изображений')
+    parser.add_argument('--only', nargs='+', help='замерять только операции, в названии которых есть подстрока')
+    parser.add_argument('--repeat', type=int, help='число запусков каждой операции')
+    parser.add_argument('--save', help='записать результаты в JSON')
+    parser.add_argument('--compare', help='сравнить с результатами из JSON')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='допустимый относительный рост')
+    parser.add_argument('--startup', action='store_true', help='замерить только время до первого окна редактора')
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        results = {'startup': startup(args.repeat or STARTUP_REPEAT)}
+    else:
+        release_freed_memory()
+        results = run(args.sizes, args.only, args.repeat)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump({'environment': environment(), 'results': results}, file, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline['environment'] != environment():
+            print('Окружение отличается от сохраненного, сравнение может быть неточным', file=sys.stderr)
+        regressions = compare(baseline['results'], results, args.threshold)
+        for size, name, field, old, new in regressions:
+            if field == 'seconds':
+                print(f'Регрессия {size} {name}: {old * 1000:.2f} мс -> {new * 1000:.2f} мс', file=sys.stderr)
+            else:
+                print(f'Регрессия {size} {name}: память {_megabytes(old).strip()} -> {_megabytes(new).strip()}',
+                      file=sys.stderr)
+        print(f'Регрессий: {len(regressions)}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
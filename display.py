@@ -0,0 +1,54 @@
+import sys
+
+from PIL import Image
+from PyQt5.QtGui import QImage, QPixmap
+
+from pipeline import FILTERS, render
+
+# Форматы QImage с 32-битными пикселями 0xAARRGGBB хранят байты в порядке машины
+if sys.byteorder == 'little':
+    RAW_MODES = {'RGB': 'BGRX', 'RGBA': 'BGRA'}
+else:
+    RAW_MODES = {'RGB': 'XRGB', 'RGBA': 'ARGB'}
+QT_FORMATS = {'RGB': QImage.Format_RGB32, 'RGBA': QImage.Format_ARGB32}
+
+
+class Frame:
+    """Отрендеренное изображение вместе с QImage для показа.
+    counts - гистограммы результата из levels.Histograms.output или None"""
+
+    def __init__(self, image: Image.Image, counts=None):
+        self.image = image
+        self.qimage = to_qimage(image)
+        self.counts = counts
+
+    def pixmap(self):
+        return QPixmap.fromImage(self.qimage)
+
+
+def to_qimage(image: Image.Image):
+    """QImage без промежуточных копий. Изображение PIL хранит строки отдельными блоками,
+    поэтому его пиксели за один проход упаковываются в непрерывный буфер в родном для Qt порядке байт"""
+    if image.mode not in QT_FORMATS:
+        image = image.convert('RGBA' if 'A' in image.mode else 'RGB')
+    data = image.tobytes('raw', RAW_MODES[image.mode])
+    qimage = QImage(data, image.width, image.height, image.width * 4, QT_FORMATS[image.mode])
+    # QImage не владеет буфером, он должен жить столько же, сколько qimage
+    qimage.buffer = data
+    return qimage
+
+
+def render_frame(image, state, *args, renderer=render, histograms=None, **kwargs):
+    """renderer (pipeline.render или stream.render_region), результат которого сразу готов к показу;
+    вызывается в RenderWorker, так что упаковка пикселей для Qt не занимает главный поток.
+    С histograms (levels.Histograms) там же считаются гистограммы результата для виджета,
+    а stream.render_region получает гистограмму всего кадра для контраста.
+    С profiler в kwargs упаковка замеряется этапом qimage"""
+    if histograms is not None and renderer is not render and state.contrast != 50:
+        kwargs['histogram'] = histograms.source(state)
+    image = renderer(image, state, *args, **kwargs)
+    if image is None:
+        return None
+    counts = None if histograms is None else histograms.output(state, kwargs.get('filters', FILTERS))
+    profiler = kwargs.get('profiler')
+    return Frame(image, counts) if profiler is None else profiler.call('qimage', Frame, image, counts)
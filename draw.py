@@ -1,12 +1,117 @@
+import math
+
 from PIL import Image, ImageEnhance, ImageFilter
 import numpy as np
 
+# Повороты на кратный 90° угол и отражения как матрицы над координатами с осью y вниз
+TRANSPOSES = {((-1, 0), (0, 1)): Image.FLIP_LEFT_RIGHT,
+              ((1, 0), (0, -1)): Image.FLIP_TOP_BOTTOM,
+              ((0, 1), (-1, 0)): Image.ROTATE_90,
+              ((-1, 0), (0, -1)): Image.ROTATE_180,
+              ((0, -1), (1, 0)): Image.ROTATE_270,
+              ((0, 1), (1, 0)): Image.TRANSPOSE,
+              ((0, -1), (-1, 0)): Image.TRANSVERSE}
+# Двоичных знаков после запятой в коэффициентах аффинной матрицы: пока координаты в исходном
+# изображении меньше 2^21, слагаемые преобразования и их суммы помещаются в 53 бита double без округления
+AFFINE_BITS = 30
+# Таблица Image.point для одного канала негатива
+NEGATIVE = [255 - i for i in range(256)]
+
 
 class TransposeHandler:
     @staticmethod
     def resize(image: Image.Image, width, height):
         return image.resize((width, height))
 
+    @staticmethod
+    def fit(image: Image.Image, width, height):
+        """Уменьшает изображение по большей стороне до размеров width x height"""
+        size = TransposeHandler.fit_size(image.width, image.height, width, height)
+        if size != image.size:
+            return image.resize(size)
+        return image
+
+    @staticmethod
+    def fit_size(width, height, fit_width, fit_height):
+        if height > width and height > fit_height:
+            k = height / fit_height
+            return int(width / k), int(height / k)
+        if width >= height and width > fit_width:
+            k = width / fit_width
+            return int(width / k), int(height / k)
+        return width, height
+
+    @staticmethod
+    def geometry(image: Image.Image, crop, rotation, horizontal_flip, vertical_flip, fit=None):
+        """Обрезка, поворот, отражения и вписывание в fit (ширина, высота) за один проход.
+        Поворот на кратный 90° угол выполняется без интерполяции"""
+        box = TransposeHandler.crop_box(image.width, image.height, crop)
+        width, height = box[2] - box[0], box[3] - box[1]
+        if rotation % 90 != 0:
+            size, matrix = TransposeHandler.affine(width, height, rotation, horizontal_flip, vertical_flip, fit)
+            return image.crop(box).transform(size, Image.AFFINE, matrix, Image.BICUBIC)
+
+        method = TransposeHandler.transpose_method(rotation, horizontal_flip, vertical_flip)
+        swap = method in (Image.ROTATE_90, Image.ROTATE_270, Image.TRANSPOSE, Image.TRANSVERSE)
+        size = (height, width) if swap else (width, height)
+        if fit is not None:
+            size = TransposeHandler.fit_size(*size, *fit)
+        if swap:
+            size = size[::-1]
+        if size == (width, height):
+            image = image.crop(box)
+        else:
+            image = image.resize(size, box=box)
+        if method is not None:
+            image = image.transpose(method)
+        return image
+
+    @staticmethod
+    def transpose_method(rotation, horizontal_flip, vertical_flip):
+        """Метод Image.transpose, равносильный повороту на кратный 90° угол и отражениям,
+        или None, если изображение не меняется"""
+        matrix = ((1, 0), (0, 1))
+        for _ in range(rotation // 90 % 4):
+            matrix = _multiply(((0, 1), (-1, 0)), matrix)
+        if horizontal_flip:
+            matrix = _multiply(((-1, 0), (0, 1)), matrix)
+        if vertical_flip:
+            matrix = _multiply(((1, 0), (0, -1)), matrix)
+        return TRANSPOSES.get(matrix)
+
+    @staticmethod
+    def affine(width, height, rotation, horizontal_flip, vertical_flip, fit=None):
+        """Размер результата и обратная матрица для Image.transform: поворот вокруг центра
+        с расширением холста, как image.rotate(rotation, expand=True), затем отражения и вписывание в fit"""
+        angle = -math.radians(rotation)
+        a, b = round(math.cos(angle), 15), round(math.sin(angle), 15)
+        d, e = round(-math.sin(angle), 15), a
+        c = a * -(width / 2) + b * -(height / 2) + width / 2
+        f = d * -(width / 2) + e * -(height / 2) + height / 2
+        if rotation % 90 == 0:
+            rotated_width, rotated_height = (height, width) if rotation // 90 % 2 else (width, height)
+        else:
+            xs = [a * x + b * y + c for x, y in ((0, 0), (width, 0), (width, height), (0, height))]
+            ys = [d * x + e * y + f for x, y in ((0, 0), (width, 0), (width, height), (0, height))]
+            rotated_width = math.ceil(max(xs)) - math.floor(min(xs))
+            rotated_height = math.ceil(max(ys)) - math.floor(min(ys))
+        c, f = (a * -(rotated_width - width) / 2 + b * -(rotated_height - height) / 2 + c,
+                d * -(rotated_width - width) / 2 + e * -(rotated_height - height) / 2 + f)
+
+        size = rotated_width, rotated_height
+        if fit is not None:
+            size = TransposeHandler.fit_size(rotated_width, rotated_height, *fit)
+        sx, sy = rotated_width / size[0], rotated_height / size[1]
+        tx, ty = 0, 0
+        if horizontal_flip:
+            sx, tx = -sx, rotated_width
+        if vertical_flip:
+            sy, ty = -sy, rotated_height
+        # Коэффициенты с шагом 2^-AFFINE_BITS: Image.transform считает координаты без округлений,
+        # поэтому часть результата со сдвигом на целое число пикселей совпадает с целым (см. stream._Geometry)
+        matrix = a * sx, b * sy, a * tx + b * ty + c, d * sx, e * sy, d * tx + e * ty + f
+        return size, tuple(round(value * 2 ** AFFINE_BITS) / 2 ** AFFINE_BITS for value in matrix)
+
     @staticmethod
     def rotate(image: Image.Image, rotation: int):
         return image.rotate(rotation)
@@ -35,6 +140,23 @@ class TransposeHandler:
             height_percent = height / 100
             return image.crop((0, 0, width, height - height_percent * percents))
 
+    @staticmethod
+    def crop_box(width, height, crop):
+        """Прямоугольник исходного изображения, который остается после
+        последовательных вызовов crop для каждой стороны из словаря crop"""
+        left, top, right, bottom = 0, 0, width, height
+        for side, percents in crop.items():
+            width, height = right - left, bottom - top
+            if side == 'left':
+                left += round(width / 100 * percents)
+            elif side == 'right':
+                right = left + round(width - width / 100 * percents)
+            elif side == 'top':
+                top += round(height / 100 * percents)
+            elif side == 'bottom':
+                bottom = top + round(height - height / 100 * percents)
+        return left, top, right, bottom
+
 
 class AdjustmentHandler:
     @staticmethod
@@ -55,64 +177,158 @@ class AdjustmentHandler:
         enhancer = ImageEnhance.Sharpness(image)
         return enhancer.enhance(factor)
 
+    @staticmethod
+    def adjust(image: Image.Image, brightness, contrast, sharpness, histogram=None):
+        """brightness, contrast и sharpness за два прохода: яркость и контраст - одна таблица
+        на канал, резкость - одна свертка 3x3. Значения 50 пропускаются.
+        histogram - image.histogram() всего изображения, если image - его часть"""
+        levels = AdjustmentHandler.levels(image, brightness, contrast, histogram)
+        if levels is not None:
+            table = levels.tolist() * 3
+            if image.mode == 'RGBA':
+                table += list(range(256))
+            image = image.point(table)
+        if sharpness != 50:
+            # Blend(SMOOTH, image, factor) как одно ядро: factor * image + (1 - factor) * SMOOTH
+            factor = sharpness / 50
+            side, center = (1 - factor) / 13, factor + (1 - factor) * 5 / 13
+            sharpened = image.filter(ImageFilter.Kernel((3, 3), [side] * 4 + [center] + [side] * 4, 1))
+            if image.mode == 'RGBA':
+                sharpened.putalpha(image.getchannel('A'))
+            image = sharpened
+        return image
+
+    @staticmethod
+    def levels(image: Image.Image, brightness, contrast, histogram=None):
+        """Таблица uint8 из 256 уровней, общая для каналов R, G, B, которой adjust применяет
+        brightness и contrast, или None, если оба равны 50"""
+        if brightness == 50 and contrast == 50:
+            return None
+        levels = _blend(0, np.arange(256), brightness / 50)
+        if contrast != 50:
+            if histogram is None:
+                histogram = image.histogram()
+            # Средняя яркость после изменения яркости с весами из image.convert('L')
+            counts = np.reshape(histogram, (-1, 256))[:3]
+            means = counts @ levels.astype(np.int64) / counts[0].sum()
+            mean = int(np.dot(means, (19595, 38470, 7471)) / 65536 + 0.5)
+            levels = _blend(mean, levels, contrast / 50)
+        return levels
+
+    @staticmethod
+    def auto_levels(histogram, clip=0.005):
+        """brightness и contrast, растягивающие уровни изображения с гистограммой histogram
+        (image.histogram() до коррекции) на 0..255. Доля clip самых темных и самых светлых
+        значений каждого канала отбрасывается"""
+        low, high, mean = _levels(histogram, clip)
+        if high <= low or mean <= low:
+            return 50, 50
+        contrast = min(mean / (mean - low), 2)
+        return _slider(255 / (mean + contrast * (high - mean))), _slider(contrast)
+
+    @staticmethod
+    def auto_white(histogram, contrast, clip=0.005):
+        """brightness, при которой самый светлый канал после contrast доходит до 255.
+        Коррекция общая для всех каналов, поэтому баланс выравнивается по белой точке, а не по каналам"""
+        _, high, mean = _levels(histogram, clip)
+        factor = contrast / 50
+        white = mean + factor * (high - mean)
+        if white <= 0:
+            return 50
+        return _slider(255 / white)
+
 
 class FilterHandler:
     @staticmethod
     def black_white(image: Image.Image):
-        res = image.copy()
-        pixels = res.load()
-        for i in range(res.width):
-            for j in range(res.height):
-                color = sum(pixels[i, j]) // 3
-                pixels[i, j] = (color, color, color)
-        return res
+        return _gray_channels(image, (0, 0, 0))
 
     @staticmethod
     def sepia(image: Image.Image, k=30):
-        res = image.copy()
-        pixels = res.load()
-        for i in range(image.width):
-            for j in range(image.height):
-                color = sum(pixels[i, j]) // 3
-                pixels[i, j] = (color + k ** 2, color + k, color)
-        return res
+        return _gray_channels(image, (k ** 2, k, 0))
 
     @staticmethod
     def negative(image: Image.Image):
-        pixels = 255 - np.array(image)
-        return Image.fromarray(pixels)
+        return image.point(NEGATIVE * len(image.getbands()))
 
 
 class BlurHandler:
     @staticmethod
-    def horizontal_blur(image: Image.Image):
-        res = image.copy()
-        width, height = res.size
-        blur(res, (0, 0, width, height // 4))
-        blur(res, (0, 0, width, 3 * height // 8))
-        blur(res, (0, 0, width, 5 * height // 16))
-        blur(res, (0, height - height // 4, width, height))
-        blur(res, (0, height - 3 * height // 8, width, height))
-        blur(res, (0, height - 5 * height // 16, width, height))
-        return res
-
-    @staticmethod
-    def vertical_blur(image: Image.Image):
-        res = image.copy()
-        width, height = res.size
-        blur(res, (0, 0, width // 4, height))
-        blur(res, (0, 0, 3 * width // 8, height))
-        blur(res, (0, 0, 5 * width // 16, height))
-        blur(res, (width - width // 4, 0, width, height))
-        blur(res, (width - 3 * width // 8, 0, width, height))
-        blur(res, (width - 5 * width // 16, 0, width, height))
-        return res
-
-
-def blur(image: Image.Image, box):
-    piece = image.crop(box)
-    piece = piece.filter(ImageFilter.GaussianBlur(1))
-    image.paste(piece, box)
+    def horizontal_blur(image: Image.Image, frame=None):
+        return BlurHandler.graduated_blur(image, frame=frame)
+
+    @staticmethod
+    def vertical_blur(image: Image.Image, frame=None):
+        return BlurHandler.graduated_blur(image, vertical=True, frame=frame)
+
+    @staticmethod
+    def graduated_blur(image: Image.Image, vertical=False, position=0.5, band=0.25, falloff=0.125,
+                       radius=0.003, frame=None):
+        """Размытие с резкой полосой шириной band (доля высоты, для vertical - ширины) с центром
+        в position, за falloff от полосы размытие нарастает до радиуса radius (доля большей стороны).
+        Размытый слой считается один раз и смешивается с изображением по маске строк или столбцов.
+        frame - (ширина, высота, левый столбец, верхняя строка), если image - часть большего изображения"""
+        width, height, left, top = frame or (image.width, image.height, 0, 0)
+        sigma = radius * max(width, height)
+        if vertical:
+            coordinates = (np.arange(left, left + image.width) + 0.5) / width
+        else:
+            coordinates = (np.arange(top, top + image.height) + 0.5) / height
+        strength = np.clip((np.abs(coordinates - position) - band / 2) / falloff, 0, 1)
+        strength = np.round(strength * 255).astype(np.uint8)
+        if not strength.any():
+            return image
+        mask = Image.fromarray(strength[None, :] if vertical else strength[:, None]).resize(image.size, Image.NEAREST)
+        return Image.composite(image.filter(ImageFilter.GaussianBlur(sigma)), image, mask)
+
+    @staticmethod
+    def halo(width, height, radius=0.003):
+        """Сколько соседних строк и столбцов нужно graduated_blur для точного результата"""
+        return math.ceil(3 * radius * max(width, height)) + 4
+
+
+def _gray_channels(image: Image.Image, offsets):
+    """Заполняет каналы средним значением пикселя со сдвигами offsets,
+    значения обрезаются до 0..255, альфа-канал становится непрозрачным.
+    Среднее считается на месте в одном массиве, каналы заполняются через таблицы PIL"""
+    pixels = np.asarray(image)
+    gray = pixels[:, :, 0].astype(np.uint16)
+    for channel in range(1, pixels.shape[2]):
+        gray += pixels[:, :, channel]
+    gray //= 3
+    del pixels
+    gray = Image.fromarray(np.minimum(gray, 255).astype(np.uint8))
+    channels = [gray.point([min(level + offset, 255) for level in range(256)]) for offset in offsets]
+    if image.mode == 'RGBA':
+        channels.append(Image.new('L', image.size, 255))
+    return Image.merge(image.mode, channels)
+
+
+def _levels(histogram, clip):
+    """Нижний и верхний уровни без доли clip крайних значений по всем каналам
+    и средняя яркость с весами из image.convert('L')"""
+    counts = np.reshape(histogram, (-1, 256))[:3]
+    total = counts[0].sum()
+    cumulative = np.cumsum(counts, axis=1) / total
+    low = min(np.searchsorted(channel, clip) for channel in cumulative)
+    high = max(np.searchsorted(channel, 1 - clip) for channel in cumulative)
+    means = counts @ np.arange(256) / total
+    return low, high, np.dot(means, (19595, 38470, 7471)) / 65536
+
+
+def _slider(factor):
+    """Значение ползунка 0..100 для множителя factor из ImageEnhance"""
+    return int(np.clip(round(factor * 50), 0, 100))
+
+
+def _blend(first, second, factor):
+    """Поканальное Image.blend(first, second, factor) над массивом уровней"""
+    levels = np.float32(first) + np.float32(factor) * (np.asarray(second, np.float32) - np.float32(first))
+    return np.clip(levels, 0, 255).astype(np.uint8)
+
+
+def _multiply(first, second):
+    return tuple(tuple(sum(first[i][k] * second[k][j] for k in range(2)) for j in range(2)) for i in range(2))
 
 
 def default_image(image: Image.Image):
@@ -0,0 +1,156 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from draw import TransposeHandler
+from pipeline import FILTERS, load_image, load_reduced, render
+import stream
+import viewport
+
+# Формат PIL по расширению файла и расширение по формату
+FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP', '.ppm': 'PPM', '.bmp': 'BMP',
+           '.tif': 'TIFF', '.tiff': 'TIFF'}
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'PPM': '.ppm', 'BMP': '.bmp', 'TIFF': '.tif'}
+# Форматы без альфа-канала
+OPAQUE_FORMATS = ('JPEG', 'PPM')
+WEB_SIDE = 2048
+THUMBNAIL_SIDE = 320
+# Пока экспорт не закончен, файлы пишутся под временными именами, чтобы отмена не оставляла обрезков
+PART_SUFFIX = '.part'
+
+
+class Variant:
+    """Один файл экспорта. suffix добавляется к имени файла, side - большая сторона
+    (None - полный размер), format - формат PIL (None - по расширению имени файла).
+    quality, progressive и optimize - параметры JPEG, quality и lossless - WebP,
+    compress_level и optimize - PNG"""
+
+    def __init__(self, suffix='', side=None, format=None, quality=90, progressive=False, optimize=False,
+                 compress_level=6, lossless=False):
+        self.suffix = suffix
+        self.side = side
+        self.format = format
+        self.quality = quality
+        self.progressive = progressive
+        self.optimize = optimize
+        self.compress_level = compress_level
+        self.lossless = lossless
+
+    def target(self, filename):
+        """Имя файла и формат варианта для экспорта в filename"""
+        stem, extension = os.path.splitext(filename)
+        image_format = self.format or FORMATS.get(extension.lower())
+        if image_format is None:
+            raise ValueError(f'Неизвестный формат файла {filename}')
+        if self.format is not None and FORMATS.get(extension.lower()) != self.format:
+            extension = EXTENSIONS[self.format]
+        return stem + self.suffix + extension, image_format
+
+    def options(self, image_format):
+        """Параметры Image.save для формата image_format"""
+        if image_format == 'JPEG':
+            return {'quality': self.quality, 'progressive': self.progressive, 'optimize': self.optimize}
+        if image_format == 'PNG':
+            return {'compress_level': self.compress_level, 'optimize': self.optimize}
+        if image_format == 'WEBP':
+            return {'quality': self.quality, 'lossless': self.lossless}
+        return {}
+
+
+def default_variants():
+    """Полный размер в формате по расширению, версия для веба и миниатюра"""
+    return [Variant(),
+            Variant('_web', WEB_SIDE, 'JPEG', quality=85, progressive=True, optimize=True),
+            Variant('_thumb', THUMBNAIL_SIDE, 'JPEG', quality=80, optimize=True)]
+
+
+def export(source, state, filename, variants, filters=FILTERS, image=None, progress=None, cancelled=None):
+    """Записывает варианты variants результата state для файла source и возвращает их имена.
+    Конвейер считается один раз в размере наибольшего варианта, меньшие уменьшаются из результата,
+    файлы кодируются параллельно. image - уже декодированный source, если он есть.
+    Если полный размер не нужен или пишется по полосам, source декодируется уменьшенным.
+    progress(сделано, всего) вызывается после рендера и после каждого файла.
+    Если cancelled() вернет True, возвращается None. При отмене и любой ошибке записанные части удаляются"""
+    if not variants:
+        raise ValueError('Не выбрано ни одного варианта экспорта')
+    targets = [variant.target(filename) for variant in variants]
+    parts = [_part(name) for name, _ in targets]
+    try:
+        return _export(source, state, variants, targets, parts, filters, image, progress, cancelled)
+    finally:
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+
+
+def _export(source, state, variants, targets, parts, filters, image, progress, cancelled):
+    sides = [variant.side for variant in variants]
+    total = len(variants) + 1
+    done = 0
+
+    # Большой файл в полном размере пишется по полосам, не собираясь в памяти целиком
+    streamed = None
+    if image is None and sides.count(None) == 1:
+        index = sides.index(None)
+        name, image_format = targets[index]
+        width, height = stream.source_size(source)
+        if (width * height > stream.STREAM_PIXELS and image_format in ('PNG', 'PPM')
+                and stream.supports(name, filters.get(state.filter))):
+            streamed = index
+            stream.render_file(source, parts[index], state, filters,
+                               compress_level=variants[index].compress_level, cancelled=cancelled)
+            done += 1
+
+    result = None
+    if streamed is None or len(variants) > 1:
+        full = None in sides and streamed is None
+        side = None if full else max(side for side in sides if side is not None)
+        if image is None:
+            image = load_image(source) if full else _load_reduced(source, state, side)
+        if full:
+            result = stream.render_image(image, state, filters, cancelled=cancelled)
+        else:
+            result = render(image, state, fit=(side, side), filters=filters, cancelled=cancelled)
+        del image
+    if progress is not None:
+        progress(done + 1, total)
+
+    def write(index):
+        if index == streamed or result is None:
+            return
+        if cancelled is not None and cancelled():
+            return
+        variant = variants[index]
+        image_format = targets[index][1]
+        output = result if variant.side is None else TransposeHandler.fit(result, variant.side, variant.side)
+        if image_format in OPAQUE_FORMATS and output.mode != 'RGB':
+            output = output.convert('RGB')
+        output.save(parts[index], image_format, **variant.options(image_format))
+
+    with ThreadPoolExecutor(len(variants)) as executor:
+        futures = [executor.submit(write, index) for index in range(len(variants)) if index != streamed]
+        for future in as_completed(futures):
+            future.result()
+            done += 1
+            if progress is not None:
+                progress(done + 1, total)
+
+    if cancelled is not None and cancelled():
+        return None
+    for part, (name, _) in zip(parts, targets):
+        os.replace(part, name)
+    return [name for name, _ in targets]
+
+
+def _load_reduced(source, state, side):
+    """source, уменьшенный так, что результат state из него не меньше side по большей стороне.
+    Меньшим вариантам полный размер не нужен, а большие файлы не помещаются в память целиком"""
+    width, height = stream.source_size(source)
+    scale = max(max(viewport.output_size((width, height), state)) / side, 1)
+    return stream._unlimited(load_reduced, source, math.ceil(width / scale), math.ceil(height / scale))
+
+
+def _part(filename):
+    """Временное имя файла с тем же расширением, по которому stream выбирает формат"""
+    stem, extension = os.path.splitext(filename)
+    return stem + PART_SUFFIX + extension
@@ -1,21 +1,13 @@
 from PIL import Image
 
+# Таблицы для Image.point: по 256 значений на каждый из каналов R, G, B
+HALF = [i // 2 for i in range(256)]
+DOUBLE = [min(i * 2, 255) for i in range(256)]
+
 
 def some_filter(image: Image.Image):
-    res = image.copy()
-    pixels = res.load()
-    for i in range(res.width):
-        for j in range(res.height):
-            r, g, b = pixels[i, j]
-            pixels[i, j] = r // 2, g * 2, b * 2
-    return res
+    return image.point(HALF + DOUBLE + DOUBLE)
 
 
 def another_filter(image: Image.Image):
-    res = image.copy()
-    pixels = res.load()
-    for i in range(res.width):
-        for j in range(res.height):
-            r, g, b = pixels[i, j]
-            pixels[i, j] = r // 2, g // 2, b * 2
-    return res
+    return image.point(HALF + HALF + DOUBLE)
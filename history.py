@@ -1,140 +1,170 @@
+import os
+import queue
 import sqlite3
+import sys
+import threading
+
+from pipeline import RECORD_FIELDS, EditState
+
+DATABASE = 'edit_history.db'
+COLUMNS = ', '.join(RECORD_FIELDS)
+SCHEMA = ('CREATE TABLE IF NOT EXISTS history '
+          '(image TEXT, seq INTEGER, rotation INTEGER, horizontal_flip BOOLEAN, '
+          'vertical_flip BOOLEAN, brightness INTEGER, contrast INTEGER, '
+          'sharpness INTEGER, crop_left INTEGER, crop_right INTEGER, '
+          'crop_top INTEGER, crop_bottom INTEGER, filter STRING, blur STRING, '
+          'PRIMARY KEY (image, seq)) WITHOUT ROWID')
+
+
+def connect(database=DATABASE):
+    connection = sqlite3.connect(database)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute(SCHEMA)
+    return connection
+
+
+def image_key(filename):
+    """Изображение в истории определяется полным путем, а не только именем файла"""
+    return os.path.abspath(filename)
+
+
+def read_latest(filename, database=DATABASE):
+    """Последняя запись истории изображения в виде словаря с полями RECORD_FIELDS или None"""
+    connection = connect(database)
+    try:
+        row = connection.execute(f'SELECT {COLUMNS} FROM history WHERE image = ? ORDER BY seq DESC LIMIT 1',
+                                 (image_key(filename),)).fetchone()
+    finally:
+        connection.close()
+    return None if row is None else dict(zip(RECORD_FIELDS, row))
+
+
+class HistoryWriter(threading.Thread):
+    """Выполняет запросы из очереди в фоне, накопившиеся запросы - одной транзакцией.
+    Ошибка SQLite (например, база заблокирована другим экземпляром редактора) отменяет
+    только свою транзакцию: она передается в sys.excepthook, и поток продолжает работу"""
+
+    def __init__(self, database):
+        super().__init__(daemon=True)
+        self.database = database
+        self.queue = queue.Queue()
+        self.start()
+
+    def run(self):
+        try:
+            connection = connect(self.database)
+        except sqlite3.Error:
+            sys.excepthook(*sys.exc_info())
+            return
+        running = True
+        while running:
+            statements = [self.queue.get()]
+            while not self.queue.empty():
+                statements.append(self.queue.get_nowait())
+            running = None not in statements
+            try:
+                with connection:
+                    for statement in statements:
+                        if statement is not None:
+                            connection.execute(*statement)
+            except sqlite3.Error:
+                sys.excepthook(*sys.exc_info())
+        connection.close()
+
+    def execute(self, *statement):
+        self.queue.put(statement)
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
 
 
 class HistoryHandler:
-    def __init__(self, obj, filename):
+    def __init__(self, obj, filename, database=DATABASE):
         self.obj = obj
-        self.table = filename.split('.')[0].split('/')[-1]
-        self.connection = sqlite3.connect('edit_history.db')
+        self.image = image_key(filename)
+        self.connection = connect(database)
+        self.writer = HistoryWriter(database)
+        # Записи, сделанные за этот сеанс, еще могут быть в очереди HistoryWriter
+        self.records = {}
+        self.import_legacy(filename)
+        row = self.connection.execute('SELECT seq FROM history WHERE image = ? ORDER BY seq DESC LIMIT 1',
+                                      (self.image,)).fetchone()
+        self.id = self.last = 0 if row is None else row[0]
+        if self.id > 0:
+            self.apply(self.record(self.id))
+
+    def import_legacy(self, filename):
+        """Переносит историю из прежней таблицы с именем файла, если для изображения еще нет записей"""
+        table = filename.split('.')[0].split('/')[-1]
         cur = self.connection.cursor()
-        res = cur.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{self.table}';").fetchall()
-        if len(res) == 0:
-            cur.execute(f"CREATE TABLE {self.table} "
-                        f"(id INTEGER PRIMARY KEY, rotation INTEGER, horizontal_flip BOOLEAN, "
-                        f"vertical_flip BOOLEAN, brightness INTEGER, contrast INTEGER, "
-                        f"sharpness INTEGER, crop_left INTEGER, crop_right INTEGER, "
-                        f"crop_top INTEGER, crop_bottom INTEGER, filter STRING, "
-                        f"blur STRING)")
-            self.id = 0
-        else:
-            res = cur.execute(f"SELECT * FROM {self.table}").fetchall()
-            if res:
-                res = res[-1]
-                self.id = res[0]
-                self.obj.rotation = res[1]
-                self.obj.horizontal_flip = res[2]
-                self.obj.vertical_flip = res[3]
-                self.obj.brightness = res[4]
-                self.obj.brightness_slider.setValue(res[4])
-                self.obj.contrast = res[5]
-                self.obj.contrast_slider.setValue(res[5])
-                self.obj.sharpness = res[6]
-                self.obj.sharpness_slider.setValue(res[6])
-                self.obj.crop['left'] = res[7]
-                self.obj.crop_left_slider.setValue(res[7])
-                self.obj.crop['right'] = res[8]
-                self.obj.crop_right_slider.setValue(res[8])
-                self.obj.crop['top'] = res[9]
-                self.obj.crop_top_slider.setValue(res[9])
-                self.obj.crop['bottom'] = res[10]
-                self.obj.crop_bottom_slider.setValue(res[10])
-                for label in self.obj.filter_labels:
-                    if label.name == res[11]:
-                        label.flag = True
-                        break
-                for label in self.obj.blur_labels:
-                    if label.name == res[12]:
-                        label.flag = True
-                        break
-            else:
-                self.id = 0
-        cur.close()
-        self.connection.commit()
+        if cur.execute('SELECT 1 FROM history WHERE image = ? LIMIT 1', (self.image,)).fetchone():
+            return
+        if not cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            return
+        with self.connection:
+            cur.execute(f'INSERT INTO history (image, seq, {COLUMNS}) '
+                        f'SELECT ?, id, {COLUMNS} FROM "{table}"', (self.image,))
+
+    def record(self, seq):
+        if seq in self.records:
+            return self.records[seq]
+        row = self.connection.execute(f'SELECT {COLUMNS} FROM history WHERE image = ? AND seq = ?',
+                                      (self.image, seq)).fetchone()
+        return dict(zip(RECORD_FIELDS, row))
+
+    def apply(self, record):
+        state = EditState.from_record(record)
+        self.obj.rotation = state.rotation
+        self.obj.horizontal_flip = state.horizontal_flip
+        self.obj.vertical_flip = state.vertical_flip
+        self.obj.brightness = state.brightness
+        self.obj.brightness_slider.setValue(state.brightness)
+        self.obj.contrast = state.contrast
+        self.obj.contrast_slider.setValue(state.contrast)
+        self.obj.sharpness = state.sharpness
+        self.obj.sharpness_slider.setValue(state.sharpness)
+        self.obj.crop = state.crop
+        self.obj.crop_left_slider.setValue(100 - state.crop['left'])
+        self.obj.crop_right_slider.setValue(100 - state.crop['right'])
+        self.obj.crop_top_slider.setValue(100 - state.crop['top'])
+        self.obj.crop_bottom_slider.setValue(100 - state.crop['bottom'])
+        for label in self.obj.filter_labels_list:
+            if label.name == state.filter:
+                self.obj.off_all_filters()
+                label.flag = True
+                break
+        for label in self.obj.blurs_labels_list:
+            if label.name == state.blur:
+                self.obj.off_all_blurs()
+                label.flag = True
+                break
 
     def write(self):
         self.id += 1
-        cur = self.connection.cursor()
-        if cur.execute(f'SELECT * FROM {self.table} WHERE id >= {self.id}').fetchall():
-            cur.execute(f'DELETE FROM {self.table} WHERE id >= {self.id}')
-        cur.execute(f"INSERT INTO {self.table}(id, rotation, "
-                    f"horizontal_flip, vertical_flip, brightness, "
-                    f"contrast, sharpness, crop_left, crop_right, crop_top, crop_bottom, "
-                    f"filter, blur) "
-                    f"VALUES({self.id}, {self.obj.rotation}, {int(self.obj.horizontal_flip)}, "
-                    f"{int(self.obj.vertical_flip)}, {self.obj.brightness}, "
-                    f"{self.obj.contrast}, {self.obj.sharpness}, {self.obj.crop['left']}, "
-                    f"{self.obj.crop['right']}, {self.obj.crop['top']}, {self.obj.crop['bottom']}, "
-                    f" '{self.obj.current_filter}', '{self.obj.current_blur}')")
-        cur.close()
-        self.connection.commit()
+        record = self.obj.edit_state().record()
+        for seq in range(self.id, self.last + 1):
+            self.records.pop(seq, None)
+        self.records[self.id] = record
+        if self.last >= self.id:
+            self.writer.execute('DELETE FROM history WHERE image = ? AND seq >= ?', (self.image, self.id))
+        self.last = self.id
+        self.writer.execute(f'INSERT INTO history (image, seq, {COLUMNS}) '
+                            f'VALUES (?, ?, {", ".join("?" * len(RECORD_FIELDS))})',
+                            (self.image, self.id, *(record[field] for field in RECORD_FIELDS)))
 
     def undo(self):
-        print('undo:')
-        cur = self.connection.cursor()
         self.id -= 1 if self.id > 0 else 0
         if self.id > 0:
-            res = cur.execute(f"SELECT * FROM {self.table} WHERE id={self.id}").fetchone()
-            self.obj.rotation = res[1]
-            self.obj.horizontal_flip = res[2]
-            self.obj.vertical_flip = res[3]
-            self.obj.brightness = res[4]
-            self.obj.brightness_slider.setValue(res[4])
-            self.obj.contrast = res[5]
-            self.obj.contrast_slider.setValue(res[5])
-            self.obj.sharpness = res[6]
-            self.obj.sharpness_slider.setValue(res[6])
-            self.obj.crop['left'] = res[7]
-            self.obj.crop_left_slider.setValue(100 - res[7])
-            self.obj.crop['right'] = res[8]
-            self.obj.crop_right_slider.setValue(100 - res[8])
-            self.obj.crop['top'] = res[9]
-            self.obj.crop_top_slider.setValue(100 - res[9])
-            self.obj.crop['bottom'] = res[10]
-            self.obj.crop_bottom_slider.setValue(100 - res[10])
-            for label in self.obj.filter_labels:
-                print(label.name.strip("'"), res[11])
-                if label.name.strip("'") == res[11]:
-                    self.obj.off_all_filters()
-                    label.flag = True
-                    break
-            for label in self.obj.blur_labels:
-                print(label.name.strip("'"), res[12])
-                if label.name.strip("'") == res[12]:
-                    self.obj.off_all_blurs()
-                    label.flag = True
-                    break
+            self.apply(self.record(self.id))
 
     def redo(self):
-        print('redo:')
-        cur = self.connection.cursor()
-        res = cur.execute(f'SELECT * FROM {self.table} WHERE id > {self.id}').fetchall()
-        if res:
-            res = res[0]
-            self.obj.rotation = res[1]
-            self.obj.horizontal_flip = res[2]
-            self.obj.vertical_flip = res[3]
-            self.obj.brightness = res[4]
-            self.obj.brightness_slider.setValue(res[4])
-            self.obj.contrast = res[5]
-            self.obj.contrast_slider.setValue(res[5])
-            self.obj.sharpness = res[6]
-            self.obj.sharpness_slider.setValue(res[6])
-            self.obj.crop['left'] = res[7]
-            self.obj.crop_left_slider.setValue(100 - res[7])
-            self.obj.crop['right'] = res[8]
-            self.obj.crop_right_slider.setValue(100 - res[8])
-            self.obj.crop['top'] = res[9]
-            self.obj.crop_top_slider.setValue(100 - res[9])
-            self.obj.crop['bottom'] = res[10]
-            self.obj.crop_bottom_slider.setValue(100 - res[10])
-            for label in self.obj.filter_labels:
-                if label.name.strip("'") == res[11]:
-                    self.obj.off_all_filters()
-                    label.flag = True
-                    break
-            for label in self.obj.blur_labels:
-                if label.name.strip("'") == res[12]:
-                    self.obj.off_all_blurs()
-                    label.flag = True
-                    break
+        if self.id < self.last:
             self.id += 1
+            self.apply(self.record(self.id))
+
+    def close(self):
+        """Дожидается записи истории на диск"""
+        self.writer.close()
+        self.connection.close()
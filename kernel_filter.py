@@ -0,0 +1,19 @@
+import numpy as np
+
+from kernels import kernel
+
+
+@kernel(pointwise=True)
+def warm_filter(pixels):
+    result = pixels.astype(np.int16)
+    result[..., 0] += 20
+    result[..., 2] -= 20
+    return result
+
+
+@kernel(pointwise=False, halo=1)
+def emboss_filter(pixels):
+    padded = np.pad(pixels[..., :3].astype(np.int16), ((1, 1), (1, 1), (0, 0)), 'edge')
+    result = pixels.astype(np.int16)
+    result[..., :3] = padded[2:, 2:] - padded[:-2, :-2] + 128
+    return result
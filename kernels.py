@@ -0,0 +1,92 @@
+import inspect
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# Меньше этого числа строк полосу не делим, накладные расходы больше выигрыша
+MIN_TILE_ROWS = 64
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class Kernel:
+    """Фильтр над массивами NumPy: func получает массив (высота, ширина, каналы) uint8
+    и возвращает массив той же формы, значения обрезаются до 0..255.
+    pointwise - результат пикселя зависит только от него самого,
+    halo - сколько соседних строк нужно для каждой строки результата,
+    tileable - можно ли обрабатывать изображение по полосам.
+    Как и обычные фильтры, вызывается с PIL.Image.Image и возвращает PIL.Image.Image"""
+
+    def __init__(self, func, pointwise=True, halo=0, tileable=True):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+        self.pointwise = pointwise
+        self.halo = 0 if pointwise else halo
+        self.tileable = tileable
+
+    def __call__(self, image: Image.Image):
+        pixels = np.asarray(image)
+        height = pixels.shape[0]
+        rows = max(-(-height // os.cpu_count()), MIN_TILE_ROWS)
+        if not self.tileable or rows >= height:
+            return _to_image(self.func(pixels))
+
+        tiles = [(top, min(top + rows, height)) for top in range(0, height, rows)]
+        results = _pool().map(lambda tile: self.run_tile(pixels, *tile), tiles)
+        result = None
+        for (top, bottom), tile in zip(tiles, results):
+            if result is None:
+                result = np.empty((height,) + tile.shape[1:], np.uint8)
+            result[top:bottom] = tile
+        return Image.fromarray(result)
+
+    def run_tile(self, pixels, top, bottom):
+        start, end = max(top - self.halo, 0), min(bottom + self.halo, pixels.shape[0])
+        result = _clip(self.func(pixels[start:end]))
+        return result[top - start:bottom - start]
+
+
+def kernel(pointwise=True, halo=0, tileable=True):
+    """Декоратор для фильтров-модулей:
+
+        @kernel(pointwise=False, halo=1)
+        def edges(pixels):
+            ...
+    """
+    return lambda func: Kernel(func, pointwise, halo, tileable)
+
+
+def plugin_filters(module):
+    """Фильтры, объявленные в самом модуле: функции над PIL.Image.Image и объекты Kernel.
+    Импортированные функции, например декоратор kernel, фильтрами не считаются"""
+    def defined_here(member):
+        if isinstance(member, Kernel):
+            member = member.func
+        elif not inspect.isfunction(member):
+            return False
+        return member.__module__ == module.__name__
+
+    return inspect.getmembers(module, defined_here)
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(os.cpu_count())
+        return _executor
+
+
+def _clip(pixels):
+    if pixels.dtype != np.uint8:
+        pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+    return pixels
+
+
+def _to_image(pixels):
+    return Image.fromarray(_clip(pixels))
@@ -0,0 +1,28 @@
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """Модуль name, который выполнится при первом обращении к любому его атрибуту.
+    Уже загруженный модуль возвращается как есть.
+    Модуль, зарегистрированный так, загружается и обычным import name, поэтому отложенным
+    он остается, только пока до него доходят через lazy_import"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def load(*modules):
+    """Выполняет отложенные модули сейчас. LazyLoader не защищен от одновременной загрузки
+    из нескольких потоков, поэтому модули загружаются в главном потоке до запуска фоновых задач"""
+    for module in modules:
+        module.__dict__
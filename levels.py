@@ -0,0 +1,38 @@
+import threading
+
+import numpy as np
+from PIL import Image
+
+from draw import TransposeHandler
+from pipeline import EditState, StageCache, FILTERS, render
+
+# Большая сторона уменьшенной копии, по которой считается статистика
+SAMPLE_SIDE = 256
+SAMPLE_CACHE_LIMIT = 8 * 1024 * 1024
+
+
+class Histograms:
+    """Гистограммы R, G, B и яркости по уменьшенной копии изображения.
+    Копия проходит через тот же конвейер с кэшем этапов, поэтому при изменении только
+    поточечных параметров пересчитываются лишь они, на нескольких десятках тысяч пикселей.
+    Гистограммы нужны и в RenderWorker, и в главном потоке, кэш этапов общий для них"""
+
+    def __init__(self, image: Image.Image):
+        self.sample = TransposeHandler.fit(image, SAMPLE_SIDE, SAMPLE_SIDE)
+        self.cache = StageCache(SAMPLE_CACHE_LIMIT)
+        self.lock = threading.Lock()
+
+    def output(self, state, filters=FILTERS):
+        """Массив (4, 256): гистограммы R, G, B и яркости результата state"""
+        with self.lock:
+            image = render(self.sample, state, filters=filters, cache=self.cache)
+        counts = np.empty((4, 256), np.int64)
+        counts[:3] = np.reshape(image.histogram(), (-1, 256))[:3]
+        counts[3] = image.convert('L').histogram()
+        return counts
+
+    def source(self, state):
+        """image.histogram() после геометрии state, но до коррекции и фильтров"""
+        neutral = EditState(state.rotation, state.horizontal_flip, state.vertical_flip, crop=state.crop)
+        with self.lock:
+            return render(self.sample, neutral, cache=self.cache).histogram()
@@ -0,0 +1,97 @@
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from draw import FilterHandler, default_image
+
+# Узлы решетки через 255 / (LUT_SIZE - 1) = 5 уровней: узлы попадают точно на целые значения,
+# поэтому цепочка считается в узлах без округления входа
+LUT_SIZE = 52
+# Сколько запеченных таблиц хранится для последних наборов параметров
+BAKED_LUTS = 16
+# Встроенные фильтры, результат которых для пикселя зависит только от его RGB
+POINTWISE = (default_image, FilterHandler.black_white, FilterHandler.sepia, FilterHandler.negative)
+
+
+class LutFilter:
+    """Фильтр из 3D LUT: одна таблица ImageFilter.Color3DLUT, применяемая с трилинейной
+    интерполяцией за один проход. Альфа-канал сохраняется"""
+    pointwise = True
+    halo = 0
+    tileable = True
+
+    def __init__(self, table: ImageFilter.Color3DLUT, name):
+        self.table = table
+        self.__name__ = name
+
+    def __call__(self, image: Image.Image):
+        return image.filter(self.table)
+
+
+def is_pointwise(func):
+    """Зависит ли результат func для пикселя только от значения этого пикселя"""
+    return func in POINTWISE or getattr(func, 'pointwise', False)
+
+
+@lru_cache(BAKED_LUTS)
+def _bake(levels, func, size):
+    pixels = _lattice(size)
+    if levels is not None:
+        pixels = np.frombuffer(levels, np.uint8)[pixels]
+    result = np.asarray(func(Image.fromarray(pixels)).convert('RGB'), np.float32) / 255
+    return ImageFilter.Color3DLUT(size, result.reshape(-1, 3), _copy_table=False)
+
+
+def bake(levels=None, func=default_image, size=LUT_SIZE):
+    """Color3DLUT для таблицы уровней levels (AdjustmentHandler.levels или None), а затем
+    поточечного фильтра func: цепочка один раз считается в узлах решетки size x size x size.
+    Последние BAKED_LUTS таблиц кэшируются, пока не изменится levels или func"""
+    return _bake(None if levels is None else np.asarray(levels, np.uint8).tobytes(), func, size)
+
+
+def load_cube(filename):
+    """LutFilter из файла .cube (формат Adobe/Resolve: LUT_3D_SIZE и строки R G B, R меняется быстрее всего)"""
+    size, title, rows = None, None, []
+    with open(filename, encoding='utf-8') as file:
+        for line in file:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            keyword, _, value = line.partition(' ')
+            if keyword == 'TITLE':
+                title = value.strip().strip('"')
+            elif keyword == 'LUT_3D_SIZE':
+                size = int(value)
+            elif keyword == 'DOMAIN_MIN' and [float(v) for v in value.split()] != [0, 0, 0] \
+                    or keyword == 'DOMAIN_MAX' and [float(v) for v in value.split()] != [1, 1, 1]:
+                raise ValueError(f'{filename}: поддерживается только область 0..1')
+            elif keyword == 'LUT_1D_SIZE':
+                raise ValueError(f'{filename}: поддерживаются только трехмерные таблицы')
+            elif keyword[0].isdigit() or keyword[0] in '+-.':
+                rows.append([float(v) for v in line.split()])
+    if size is None or len(rows) != size ** 3:
+        raise ValueError(f'{filename}: ожидалось LUT_3D_SIZE и size^3 строк значений')
+    name = re.sub(r'\W', '_', title or os.path.splitext(os.path.basename(filename))[0])
+    table = ImageFilter.Color3DLUT(size, np.clip(np.array(rows, np.float32), 0, 1), _copy_table=False)
+    return LutFilter(table, f'cube_{name}')
+
+
+def save_cube(filename, table: ImageFilter.Color3DLUT, title=None):
+    """Записывает трехмерную таблицу table в формате .cube"""
+    values = np.asarray(table.table, np.float32).reshape(-1, table.channels)[:, :3]
+    with open(filename, 'w', encoding='utf-8') as file:
+        if title:
+            file.write(f'TITLE "{title}"\n')
+        file.write(f'LUT_3D_SIZE {table.size[0]}\n')
+        file.write('DOMAIN_MIN 0 0 0\nDOMAIN_MAX 1 1 1\n')
+        np.savetxt(file, values, '%.6f')
+
+
+def _lattice(size):
+    """Узлы решетки как изображение (size^2, size), порядок как у Color3DLUT: R меняется быстрее всего"""
+    steps = np.round(np.arange(size) * 255 / (size - 1)).astype(np.uint8)
+    blue, green, red = np.meshgrid(steps, steps, steps, indexing='ij')
+    return np.stack([red, green, blue], -1).reshape(size * size, size, 3)
@@ -1,14 +1,34 @@
 import sys
 import importlib
-import inspect
-from operator import attrgetter
-from PyQt5.QtWidgets import QMainWindow, QApplication, QFileDialog, QMessageBox
-from PIL import Image, ImageQt
-
-from UIelems import Ui_MainWindow
-from draw import TransposeHandler, AdjustmentHandler, FilterHandler, BlurHandler
-from history import HistoryHandler
-
+import math
+import os
+from PyQt5.QtCore import QEvent, QRect, Qt, QTimer
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtWidgets import QMainWindow, QApplication, QDialog, QFileDialog, QMessageBox, QAction
+
+from UIelems import Ui_MainWindow, ExportDialog
+from lazy import lazy_import, load
+from worker import RenderWorker, ThumbnailWorker, ExportWorker
+
+# NumPy и PIL вместе с модулями обработки загружаются после показа окна, см. load_modules
+display = lazy_import('display')
+draw = lazy_import('draw')
+export = lazy_import('export')
+history = lazy_import('history')
+kernels = lazy_import('kernels')
+levels = lazy_import('levels')
+lut = lazy_import('lut')
+pipeline = lazy_import('pipeline')
+processes = lazy_import('processes')
+profiling = lazy_import('profiling')
+stream = lazy_import('stream')
+viewport = lazy_import('viewport')
+
+THUMBNAIL_CACHE_LIMIT = 32 * 1024 * 1024
+# Сколько байт занимают готовые кадры предпросмотра для отмены и повтора
+SNAPSHOT_CACHE_LIMIT = 64 * 1024 * 1024
+# Подписи вариантов export.default_variants в окне сохранения
+EXPORT_NAMES = ('Полный размер', 'Для веба', 'Миниатюра')
 OFF_SS = 'border: 1px solid gray'
 ON_SS = 'border: 1px solid blue'
 
@@ -17,7 +37,27 @@ class PhotoEditorApp(QMainWindow, Ui_MainWindow):
     def __init__(self):
         super().__init__()
         self.image = None
+        self.source_image = None
+        self.source_size = None
         self.default_image = None
+        # Кэши и вид создаются при открытии файла, см. open_image
+        self.stage_cache = None
+        self.render_worker = RenderWorker(self)
+        self.thumbnail_cache = None
+        self.thumbnail_worker = ThumbnailWorker(self)
+        self.snapshots = None
+        self.histograms = None
+        self.pyramid = None
+        self.pyramid_worker = ThumbnailWorker(self)
+        self.export_worker = ExportWorker(self)
+        self.export_dialog = None
+        self.viewport = None
+        self.frame = None
+        self.frame_region = None
+        self.frame_size = None
+        self.drag = None
+        self.profiler = None
+        self.modules_loaded = False
         self.filters_loaded = False
         self.blurs_loaded = False
         self.saved = True
@@ -33,10 +73,9 @@ class PhotoEditorApp(QMainWindow, Ui_MainWindow):
         self.write = True
         self.current_filter = 'По_умолчанию'
         self.current_blur = 'По_умолчанию'
+        self.filter_labels_list = []
+        self.blurs_labels_list = []
         self.initUI()
-        self.filter_labels_list = [self.default_fliter_label, self.black_white_filter_label,
-                                   self.sepia_filter_label, self.negative_filter_label]
-        self.blurs_labels_list = [self.default_blur_label, self.horizontal_blur_label, self.vertical_blur_label]
 
     def set_default_values(self):
         """Устанавливает значения по умолчанию,
@@ -74,6 +113,47 @@ class PhotoEditorApp(QMainWindow, Ui_MainWindow):
         Подключает функции к кнопкам интерфейса,
         а также отображает интерфейс"""
         self.setupUi(self)
+        self.export_worker.progress.connect(self.export_progress_changed)
+        self.export_worker.exported.connect(self.export_finished)
+        self.export_worker.failed.connect(self.export_failed)
+        self.export_cancel_button.clicked.connect(self.export_worker.cancel)
+        self.render_worker.rendered.connect(self.show_image)
+        self.thumbnail_worker.rendered.connect(self.show_thumbnail)
+        self.actionOpen.triggered.connect(self.open_image)
+        self.actionSave.triggered.connect(self.save_image)
+        self.actionReset.triggered.connect(self.reset)
+        self.actionAddFilter.triggered.connect(self.add_filter)
+        self.actionLoadCube.triggered.connect(self.load_cube)
+        self.actionSaveCube.triggered.connect(self.save_cube)
+        self.actionUndo.triggered.connect(self.undo)
+        self.actionRedo.triggered.connect(self.redo)
+        self.pyramid_worker.rendered.connect(self.pyramid_loaded)
+        self.image_label.installEventFilter(self)
+        self.actionProfile = QAction('Профилирование', self, checkable=True)
+        self.actionProfile.toggled.connect(self.toggle_profiler)
+        self.menuEdit.addAction(self.actionProfile)
+        self.image_label.setText('Для того, чтобы начать, загрузите фото')
+        self.show()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.modules_loaded:
+            self.modules_loaded = True
+            QTimer.singleShot(0, self.load_modules)
+
+    def load_modules(self):
+        """Загружает модули обработки после первой отрисовки окна: к открытию файла они готовы,
+        и фоновые потоки не загружают их одновременно"""
+        load(display, draw, export, history, kernels, levels, lut, pipeline, processes, profiling, stream, viewport)
+        self.actionProfile.setChecked(bool(os.environ.get(profiling.PROFILE_ENV)))
+
+    def init_tabs(self):
+        """Создает панель вкладок и подключает ее виджеты. До открытия файла панель скрыта,
+        поэтому она строится при первом открытии, а не при запуске"""
+        if self.menu_tab is not None:
+            return
+        self.setupTabs()
+        self.menu_tab.setVisible(False)
         self.rotate_minus90_button.clicked.connect(self.rotate_minus90)
         self.rotate_minus90_button.clicked.connect(self.update_image)
         self.rotate_plus90_button.clicked.connect(self.rotate_plus90)
@@ -82,10 +162,6 @@ class PhotoEditorApp(QMainWindow, Ui_MainWindow):
         self.flip_horizontal_button.clicked.connect(self.update_image)
         self.flip_vertical_button.clicked.connect(self.flip_vertical)
         self.flip_vertical_button.clicked.connect(self.update_image)
-        self.actionOpen.triggered.connect(self.open_image)
-        self.actionSave.triggered.connect(self.save_image)
-        self.actionReset.triggered.connect(self.reset)
-        self.actionAddFilter.triggered.connect(self.add_filter)
         self.brightness_slider.sliderReleased.connect(self.change_brightness)
         self.brightness_slider.sliderReleased.connect(self.update_image)
         self.contrast_slider.sliderReleased.connect(self.change_contrast)
@@ -100,6 +176,15 @@ class PhotoEditorApp(QMainWindow, Ui_MainWindow):
         self.crop_top_slider.sliderReleased.connect(self.update_image)
         self.crop_bottom_slider.sliderReleased.connect(self.crop_bottom_trigger)
         self.crop_bottom_slider.sliderReleased.connect(self.update_image)
+        self.slider_triggers = {self.brightness_slider: self.change_brightness,
+                                self.contrast_slider: self.change_contrast,
+                                self.sharpness_slider: self.change_sharpness,
+                                self.crop_left_slider: self.crop_left_trigger,
+                                self.crop_right_slider: self.crop_right_trigger,
+                                self.crop_top_slider: self.crop_top_trigger,
+                                self.crop_bottom_slider: self.crop_bottom_trigger}
+        for slider in self.slider_triggers:
+            slider.valueChanged.connect(self.preview_slider)
         self.default_fliter_label.clicked.connect(self.activate_filter)
         self.black_white_filter_label.clicked.connect(self.activate_filter)
         self.sepia_filter_label.clicked.connect(self.activate_filter)
@@ -109,70 +194,191 @@ class PhotoEditorApp(QMainWindow, Ui_MainWindow):
         self.vertical_blur_label.clicked.connect(self.activate_blur)
         self.default_fliter_label.resizeEvent = self.set_filters_thumbnails
         self.default_blur_label.resizeEvent = self.set_blurs_thumbnails
-        self.actionUndo.triggered.connect(self.undo)
-        self.actionRedo.triggered.connect(self.redo)
-        self.menu_tab.setVisible(False)
-        self.image_label.setText('Для того, чтобы начать, загрузите фото')
-        self.show()
+        self.auto_levels_button.clicked.connect(self.auto_levels)
+        self.auto_white_button.clicked.connect(self.auto_white)
+        self.filter_labels_list = [self.default_fliter_label, self.black_white_filter_label,
+                                   self.sepia_filter_label, self.negative_filter_label]
+        self.blurs_labels_list = [self.default_blur_label, self.horizontal_blur_label, self.vertical_blur_label]
 
     def update_image(self):
         """Обновляет отображаемое изображение, применяет необходимые функции
         Вызывается при любом изменении изобраения"""
-        self.image = self.default_image.copy()
-        for key, value in self.crop.items():
-            self.image = TransposeHandler.crop(self.image, key, value)
-        self.image = TransposeHandler.rotate(self.image, self.rotation)
-        if self.horizontal_flip:
-            self.image = TransposeHandler.horizontal_flip(self.image)
-        if self.vertical_flip:
-            self.image = TransposeHandler.vertical_flip(self.image)
-        self.image = self.normalize_image(self.image)
-
-        self.image = AdjustmentHandler.brightness(self.image, self.brightness)
-        self.image = AdjustmentHandler.contrast(self.image, self.contrast)
-        self.image = AdjustmentHandler.sharpness(self.image, self.sharpness)
-
+        self.current_filter = pipeline.DEFAULT
         for label in self.filter_labels_list:
-            print(f'{label.name}: {label.flag}')
-
-        if any(map(attrgetter('flag'), self.filter_labels_list)):
-            for label in self.filter_labels_list:
-                if label.flag:
-                    self.image = label.func(self.image)
-                    self.current_filter = label.name
-                    label.setStyleSheet(ON_SS)
-                    break
-
-        for label in self.blurs_labels_list:
-            print(f'{label.name}: {label.flag}')
+            if label.flag:
+                self.current_filter = label.name
+                label.setStyleSheet(ON_SS)
+                break
 
         if self.horizontal_blur_label.flag:
-            self.image = self.horizontal_blur_label.func(self.image)
             self.horizontal_blur_label.setStyleSheet(ON_SS)
             self.current_blur = self.horizontal_blur_label.name
         elif self.vertical_blur_label.flag:
-            self.image = self.vertical_blur_label.func(self.image)
             self.vertical_blur_label.setStyleSheet(ON_SS)
             self.current_blur = self.vertical_blur_label.name
         else:
             self.default_blur_label.setStyleSheet(ON_SS)
-            self.current_blur = 'По_умолчанию'
+            self.current_blur = pipeline.DEFAULT
 
-        self.image_label.setPixmap(ImageQt.toqpixmap(self.image))
+        self.render_preview()
         self.saved = False
         if self.write and self.history_manager is not None:
-            self.history_manager.write()
+            self.measure('history', self.history_manager.write)
         self.write = True
 
-    def normalize_image(self, image: Image.Image):
+    def render_preview(self, snapshot=True):
+        """Показывает готовый кадр текущего состояния из self.snapshots или запускает фоновый рендер,
+        результат отобразит show_image. Промежуточные состояния ползунков передают snapshot=False"""
+        state = self.edit_state()
+        source, fit = self.view_source(state)
+        region = frame = None
+        if self.viewport.zoom != 1:
+            label = (self.image_label.width(), self.image_label.height())
+            frame = viewport.output_size(source.size, state, fit)
+            region = self.viewport.region(viewport.output_size(self.source_size, state), label, frame)
+        key = ((state.key(), fit, id(source), region) if snapshot else None, region, frame)
+        image = None if key[0] is None else self.snapshots.get(key[0])
+        if image is not None:
+            # Готовые кадры берутся при отмене и повторе, не при перетаскивании ползунка
+            self.render_worker.cancel()
+            counts = self.histograms.output(state, self.filter_funcs())
+            self.show_image(key, self.measure('qimage', display.Frame, image, counts))
+            return
+        # Гистограммы для виджета считаются в той же фоновой задаче, что и кадр
+        if region is None:
+            self.render_worker.submit(key, display.render_frame, source, state, fit=fit, filters=self.filter_funcs(),
+                                      cache=self.stage_cache, histograms=self.histograms, profiler=self.profiler)
+        else:
+            # При увеличении обрабатывается только видимая часть, контраст - по гистограмме всего кадра.
+            # Обычные фильтры из модулей получают весь кадр, render_region считает его с self.stage_cache
+            self.render_worker.submit(key, display.render_frame, source, state, region, fit=fit,
+                                      filters=self.filter_funcs(), histograms=self.histograms,
+                                      renderer=stream.render_region, profiler=self.profiler, cache=self.stage_cache)
+
+    def view_source(self, state):
+        """Изображение, из которого рендерится текущий вид, и размеры, в которые вписывается результат.
+        При увеличении берется самый маленький уровень пирамиды, которого хватает для экрана"""
+        label = (self.image_label.width(), self.image_label.height())
+        if self.viewport.zoom == 1:
+            return self.default_image, label
+        output = viewport.output_size(self.source_size, state)
+        width, height = self.viewport.display_size(output, label)
+        source = self.default_image if self.pyramid is None else self.pyramid.level(width / output[0])
+        return source, (math.ceil(width), math.ceil(height))
+
+    def show_image(self, key, frame):
+        """key - (ключ в self.snapshots или None, часть кадра или None для целого, размеры кадра)"""
+        snapshot, region, size = key
+        if snapshot is not None:
+            self.snapshots.put(snapshot, frame.image)
+        self.image = frame.image
+        self.frame = frame
+        if frame.counts is not None:
+            self.histogram_widget.set_counts(frame.counts)
+        self.frame_region = region or (0, 0, *frame.image.size)
+        self.frame_size = size or frame.image.size
+        self.measure('pixmap', self.show_view)
+        if self.profiler is not None:
+            self.statusbar.showMessage(self.profiler.summary())
+
+    def show_view(self):
+        """Показывает видимую часть последнего кадра, при увеличении больше кадра растягивает ее"""
+        label = (self.image_label.width(), self.image_label.height())
+        if self.viewport.zoom == 1 and self.frame_size == self.frame.image.size:
+            self.image_label.setPixmap(self.frame.pixmap())
+            return
+        output = viewport.output_size(self.source_size, self.edit_state())
+        shown = self.viewport.display_size(output, label)
+        x, y, width, height = self.viewport.window(output, label)
+        scale_x, scale_y = shown[0] / self.frame_size[0], shown[1] / self.frame_size[1]
+        left, top, right, bottom = self.frame_region
+        rect = QRect(int(x / scale_x) - left, int(y / scale_y) - top,
+                     max(round(width / scale_x), 1), max(round(height / scale_y), 1))
+        if rect.left() < 0 or rect.top() < 0 or rect.right() >= right - left or rect.bottom() >= bottom - top:
+            # Вид вышел за отрендеренную часть, пока новая не готова, край остается пустым
+            self.render_preview()
+        pixmap = QPixmap.fromImage(self.frame.qimage.copy(rect))
+        if scale_x > 1.01 or scale_y > 1.01:
+            # Пиксели исходного изображения при сильном увеличении показываются квадратами
+            mode = Qt.FastTransformation if scale_x >= 2 else Qt.SmoothTransformation
+            pixmap = pixmap.scaled(round(width), round(height), Qt.IgnoreAspectRatio, mode)
+        self.image_label.setPixmap(pixmap)
+
+    def eventFilter(self, obj, event):
+        """Колесо мыши меняет масштаб, перетаскивание сдвигает вид, двойной щелчок возвращает масштаб"""
+        if obj is not self.image_label or self.frame is None:
+            return super().eventFilter(obj, event)
+        label = (self.image_label.width(), self.image_label.height())
+        output = viewport.output_size(self.source_size, self.edit_state())
+        if event.type() == QEvent.Wheel:
+            factor = viewport.ZOOM_STEP if event.angleDelta().y() > 0 else 1 / viewport.ZOOM_STEP
+            self.viewport.zoom_at(factor, (event.pos().x(), event.pos().y()), output, label)
+            self.render_preview()
+            return True
+        if event.type() == QEvent.MouseButtonDblClick:
+            self.viewport.reset()
+            self.render_preview()
+            return True
+        if event.type() == QEvent.MouseButtonPress:
+            self.drag = event.pos()
+            return True
+        if event.type() == QEvent.MouseMove and self.drag is not None:
+            delta = event.pos() - self.drag
+            self.drag = event.pos()
+            self.viewport.pan(delta.x(), delta.y(), output, label)
+            self.show_view()
+            return True
+        if event.type() == QEvent.MouseButtonRelease:
+            self.drag = None
+            return True
+        return super().eventFilter(obj, event)
+
+    def pyramid_loaded(self, filename, pyramid):
+        if filename != self.filename:
+            return
+        self.pyramid = pyramid
+        if self.source_image is None:
+            self.source_image = pyramid.levels[0]
+        if self.viewport.zoom != 1:
+            self.render_preview()
+
+    def toggle_profiler(self, enabled):
+        """Включает замеры этапов: строка состояния, profile.log и profile_trace.json при выключении"""
+        if enabled and self.profiler is None:
+            self.profiler = profiling.Profiler()
+        elif not enabled and self.profiler is not None:
+            self.profiler.export_trace()
+            self.profiler.close()
+            self.profiler = None
+            self.statusbar.clearMessage()
+
+    def measure(self, stage, func, *args):
+        """func(*args), при включенных замерах - как этап stage"""
+        if self.profiler is None:
+            return func(*args)
+        return self.profiler.call(stage, func, *args)
+
+    def preview_slider(self):
+        """Живой предпросмотр при перетаскивании ползунка, в историю записывается
+        только отпускание ползунка"""
+        slider = self.sender()
+        if slider.isSliderDown() and self.default_image is not None:
+            self.slider_triggers[slider]()
+            self.render_preview(snapshot=False)
+
+    def edit_state(self):
+        """Текущие параметры редактирования"""
+        return pipeline.EditState(self.rotation, self.horizontal_flip, self.vertical_flip,
+                                  self.brightness, self.contrast, self.sharpness, self.crop,
+                                  self.current_filter, self.current_blur)
+
+    def filter_funcs(self):
+        """Фильтры по названиям, включая добавленные пользователем"""
+        return {label.name: label.func for label in self.filter_labels_list}
+
+    def normalize_image(self, image):
         """Изменяет размеры изображения для адекватного отображения"""
-        if image.height > image.width and image.height > self.image_label.height():
-            k = image.height / self.image_label.height()
-            return image.resize((int(image.width / k), int(image.height / k)))
-        if image.width > image.height and image.width > self.image_label.width():
-            k = image.width / self.image_label.width()
-            return image.resize((int(image.width / k), int(image.height / k)))
-        return image
+        return draw.TransposeHandler.fit(image, self.image_label.width(), self.image_label.height())
 
     def open_image(self):
         """Открывает изображение, выбранное пользователем, вызывает функции для отображения миниатюр"""
@@ -183,51 +389,113 @@ class PhotoEditorApp(QMainWindow, Ui_MainWindow):
                 return
         self.filename = QFileDialog.getOpenFileName(self, 'Выберите изображение', '', 'Image (*.jpg *.png)')[0]
         if self.filename != '':
+            self.init_tabs()
             self.menu_tab.setVisible(True)
-            image = ImageQt.toqpixmap(self.normalize_image(Image.open(self.filename)))
+            # Полное разрешение и пирамида для увеличения декодируются в фоне, см. pyramid_loaded
+            self.source_image = None
+            self.pyramid = None
+            self.frame = None
+            self.viewport = viewport.Viewport()
+            size = (self.image_label.width(), self.image_label.height())
+            preview, self.source_size = self.measure('normalize', pipeline.load_preview, self.filename, *size)
             self.image_label.setText('')
-            self.image_label.setPixmap(image)
-            self.default_image = ImageQt.fromqpixmap(image)
+            self.image_label.setPixmap(display.Frame(preview).pixmap())
+            self.render_worker.cancel()
+            self.default_image = preview
+            self.histograms = levels.Histograms(preview)
+            self.pyramid_worker.submit(self.filename, viewport.Pyramid.load, self.filename)
+            self.stage_cache = pipeline.StageCache()
+            self.snapshots = pipeline.StageCache(SNAPSHOT_CACHE_LIMIT)
+            self.thumbnail_cache = pipeline.StageCache(THUMBNAIL_CACHE_LIMIT)
             self.image = self.default_image.copy()
             self.set_default_values()
             self.set_filters_thumbnails(None)
             self.set_blurs_thumbnails(None)
-            self.history_manager = HistoryHandler(self, self.filename)
+            if self.history_manager is not None:
+                self.history_manager.close()
+            self.history_manager = history.HistoryHandler(self, self.filename)
             self.update_image()
 
     def set_filters_thumbnails(self, event):
         """Устанавливает миниатюры для виджетов во вкладке Фильтры
         Вызывается после изменения размеров одного из виджетов, так как изначально
         виджеты имеют неправильные размеры"""
-        img = TransposeHandler.resize(self.default_image, self.default_fliter_label.width(),
-                                      self.default_fliter_label.height())
-        self.default_fliter_label.setPixmap(ImageQt.toqpixmap(img))
-        self.black_white_filter_label.setPixmap(ImageQt.toqpixmap(FilterHandler.black_white(img)))
-        self.sepia_filter_label.setPixmap(ImageQt.toqpixmap(FilterHandler.sepia(img)))
-        self.negative_filter_label.setPixmap(ImageQt.toqpixmap(FilterHandler.negative(img)))
+        size = (self.default_fliter_label.width(), self.default_fliter_label.height())
         for label in self.filter_labels_list:
-            label.setPixmap(ImageQt.toqpixmap(label.func(img)))
+            self.set_thumbnail(label, size)
         self.filters_loaded = True
 
     def set_blurs_thumbnails(self, event):
         """Устанавливает миниатюры для виджетов во вкладке Размытие
         Вызывается после изменения размеров одного из виджетов, так как изначально
         виджеты имеют неправильные размеры"""
-        img = TransposeHandler.resize(self.default_image, self.default_blur_label.width(),
-                                      self.default_blur_label.height())
-        self.default_blur_label.setPixmap(ImageQt.toqpixmap(img))
-        self.horizontal_blur_label.setPixmap(ImageQt.toqpixmap(BlurHandler.horizontal_blur(img)))
-        self.vertical_blur_label.setPixmap(ImageQt.toqpixmap(BlurHandler.vertical_blur(img)))
+        size = (self.default_blur_label.width(), self.default_blur_label.height())
+        for label in self.blurs_labels_list:
+            self.set_thumbnail(label, size)
         self.blurs_loaded = True
 
+    def set_thumbnail(self, label, size):
+        """Берет миниатюру из кэша или отправляет ее рендер в ThumbnailWorker"""
+        label.thumbnail_key = (label.name, label.func, size)
+        image = self.thumbnail_cache.get(label.thumbnail_key)
+        if image is not None:
+            label.setPixmap(display.Frame(image).pixmap())
+            return
+        base = self.thumbnail_cache.get(('base', size))
+        if base is None:
+            base = draw.TransposeHandler.resize(self.default_image, *size)
+            self.thumbnail_cache.put(('base', size), base)
+        self.thumbnail_worker.submit(label.thumbnail_key, label.func, base)
+
+    def show_thumbnail(self, key, image):
+        labels = [label for label in self.filter_labels_list + self.blurs_labels_list
+                  if getattr(label, 'thumbnail_key', None) == key]
+        if labels:
+            self.thumbnail_cache.put(key, image)
+        for label in labels:
+            label.setPixmap(display.Frame(image).pixmap())
+
     def save_image(self):
-        """Отображает диалоговое окно для сохранения"""
+        """Отображает диалоговые окна для сохранения, файлы записываются в фоне"""
         filename = QFileDialog.getSaveFileName(self, 'Сохранить как', '')[0]
-        if filename != '':
-            self.image.save(filename)
+        if filename != '' and self.export_dialog is None:
+            self.export_dialog = ExportDialog(self, export.default_variants(), EXPORT_NAMES)
+        if filename != '' and self.export_dialog.exec() == QDialog.Accepted:
+            variants = self.export_dialog.variants()
+            if not variants:
+                return
+            # Если полное изображение еще не декодировано, это сделает поток экспорта
+            self.export_worker.submit(filename, export.export, self.filename, self.edit_state(), filename, variants,
+                                      self.filter_funcs(), image=self.source_image)
+            self.export_progress.setValue(0)
+            self.export_progress.show()
+            self.export_cancel_button.show()
             self.saved = True
 
+    def export_progress_changed(self, filename, done, total):
+        self.export_progress.setFormat(f'{os.path.basename(filename)}: %p%')
+        self.export_progress.setMaximum(total)
+        self.export_progress.setValue(done)
+
+    def export_finished(self, filename, filenames):
+        if filenames is None:
+            self.saved = False
+        else:
+            self.statusbar.showMessage('Сохранено: ' + ', '.join(map(os.path.basename, filenames)), 5000)
+        self.hide_export_progress()
+
+    def export_failed(self, filename, message):
+        self.saved = False
+        self.hide_export_progress()
+        QMessageBox.warning(self, 'Предупреждение', f'Не удалось сохранить {filename}:\n{message}', QMessageBox.Ok)
+
+    def hide_export_progress(self):
+        if not self.export_worker.busy():
+            self.export_progress.hide()
+            self.export_cancel_button.hide()
+
     def reset(self):
+        self.init_tabs()
         self.set_default_values()
         self.update_image()
 
@@ -284,6 +552,21 @@ class PhotoEditorApp(QMainWindow, Ui_MainWindow):
         self.sender().flag = True
         self.update_image()
 
+    def auto_levels(self):
+        """Растягивает уровни на весь диапазон ползунками яркости и контраста"""
+        histogram = self.histograms.source(self.edit_state())
+        self.brightness, self.contrast = draw.AdjustmentHandler.auto_levels(histogram)
+        self.brightness_slider.setValue(self.brightness)
+        self.contrast_slider.setValue(self.contrast)
+        self.update_image()
+
+    def auto_white(self):
+        """Подбирает яркость по белой точке при текущем контрасте"""
+        histogram = self.histograms.source(self.edit_state())
+        self.brightness = draw.AdjustmentHandler.auto_white(histogram, self.contrast)
+        self.brightness_slider.setValue(self.brightness)
+        self.update_image()
+
     def undo(self):
         self.history_manager.undo()
         self.write = False
@@ -297,6 +580,14 @@ class PhotoEditorApp(QMainWindow, Ui_MainWindow):
     def closeEvent(self, event):
         """Проверка на случай, если пользователь не сохранил изменения
         Вызывается при закрытии"""
+        if self.export_worker.busy():
+            flag = QMessageBox.question(self, '', 'Экспорт еще не закончен\nПрервать его и выйти?',
+                                        QMessageBox.Yes, QMessageBox.No)
+            if flag == QMessageBox.No:
+                event.ignore()
+                return
+            self.export_worker.cancel()
+            self.export_worker.wait()
         if not self.saved:
             flag = QMessageBox.question(self, '', 'Есть несохраненные изменения\nВы точно хотите выйти?',
                                         QMessageBox.Yes, QMessageBox.No)
@@ -304,6 +595,10 @@ class PhotoEditorApp(QMainWindow, Ui_MainWindow):
                 event.accept()
             else:
                 event.ignore()
+        if event.isAccepted() and self.history_manager is not None:
+            self.history_manager.close()
+        if event.isAccepted():
+            self.actionProfile.setChecked(False)
 
     def add_filter(self):
         """Добавление фильтра"""
@@ -312,23 +607,58 @@ class PhotoEditorApp(QMainWindow, Ui_MainWindow):
                                                     'изображений.\n'
                                                     'Функции должны принимать на вход объекты класса PIL.Image.Image'
                                                     'и возвращать так же объекты класса PIL.Image.Image.\n'
+                                                    'Функции над массивами NumPy объявляются декоратором '
+                                                    'kernels.kernel, см. kernel_filter.py.\n'
                                                     'Файл, содержащий функции должен находиться в одной директории '
                                                     'с main.py.',
                             QMessageBox.Ok)
         name = QFileDialog.getOpenFileName(self, 'Открыть файл с фильтрами', '', "Python file (*.py)")[0]
         if name:
             file = importlib.import_module(name.split('/')[-1].split('.')[0])
-            for func in inspect.getmembers(file, inspect.isfunction):
-                label = self.add_filter_label(func[1])
-                label.flag = False
-                label.name = func[0]
-                label.func = func[1]
-                self.filter_labels_list.append(label)
-                label.clicked.connect(self.activate_filter)
-                if self.filters_loaded:
-                    img = TransposeHandler.resize(self.default_image, self.default_fliter_label.width(),
-                                                  self.default_fliter_label.height())
-                    label.setPixmap(ImageQt.toqpixmap(label.func(img)))
+            for func_name, func in kernels.plugin_filters(file):
+                # Обычные функции могут быть циклами на Python, которые держат GIL
+                self.add_filter_entry(func_name, func if isinstance(func, kernels.Kernel)
+                                      else processes.ProcessFilter(func))
+
+    def load_cube(self):
+        """Добавление фильтра из таблицы .cube"""
+        name = QFileDialog.getOpenFileName(self, 'Открыть таблицу цвета', '', 'Cube LUT (*.cube)')[0]
+        if name:
+            try:
+                func = lut.load_cube(name)
+            except ValueError as error:
+                QMessageBox.warning(self, 'Предупреждение', str(error), QMessageBox.Ok)
+                return
+            self.add_filter_entry(func.__name__, func)
+
+    def save_cube(self):
+        """Сохраняет яркость, контраст и текущий фильтр одной таблицей .cube.
+        Резкость и размытие зависят от соседних пикселей и в таблицу не входят"""
+        state = self.edit_state()
+        filter_func = self.filter_funcs().get(state.filter, draw.default_image)
+        if not lut.is_pointwise(filter_func):
+            QMessageBox.warning(self, 'Предупреждение', 'Текущий фильтр зависит от соседних пикселей '
+                                                        'и не может быть записан в таблицу .cube',
+                                QMessageBox.Ok)
+            return
+        name = QFileDialog.getSaveFileName(self, 'Сохранить таблицу цвета', '', 'Cube LUT (*.cube)')[0]
+        if name:
+            histogram = self.histograms.source(state)
+            table = draw.AdjustmentHandler.levels(self.image, state.brightness, state.contrast, histogram)
+            lut.save_cube(name, lut.bake(table, filter_func), os.path.splitext(os.path.basename(name))[0])
+
+    def add_filter_entry(self, name, func):
+        """Кнопка фильтра func на вкладке фильтров"""
+        self.init_tabs()
+        label = self.add_filter_label(func)
+        label.flag = False
+        label.name = name
+        label.func = func
+        self.filter_labels_list.append(label)
+        label.clicked.connect(self.activate_filter)
+        if self.filters_loaded:
+            self.set_thumbnail(label, (self.default_fliter_label.width(),
+                                       self.default_fliter_label.height()))
 
 
 def except_hook(cls, exception, traceback):
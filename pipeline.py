@@ -0,0 +1,203 @@
+from collections import OrderedDict
+
+from PIL import Image
+
+from draw import TransposeHandler, AdjustmentHandler, FilterHandler, BlurHandler, default_image
+from lut import LutFilter, bake
+
+DEFAULT = 'По_умолчанию'
+FILTERS = {DEFAULT: default_image,
+           'Черно-белый': FilterHandler.black_white,
+           'Негатив': FilterHandler.negative,
+           'Сепия': FilterHandler.sepia}
+BLURS = {DEFAULT: default_image,
+         'Вертикальное размытие': BlurHandler.vertical_blur,
+         'Горизонтальное размытие': BlurHandler.horizontal_blur}
+RECORD_FIELDS = ('rotation', 'horizontal_flip', 'vertical_flip', 'brightness', 'contrast',
+                 'sharpness', 'crop_left', 'crop_right', 'crop_top', 'crop_bottom', 'filter', 'blur')
+# Сколько байт могут занимать закэшированные результаты этапов
+CACHE_LIMIT = 256 * 1024 * 1024
+
+
+class EditState:
+    """Набор параметров редактирования, тот же, что сохраняет HistoryHandler"""
+
+    def __init__(self, rotation=0, horizontal_flip=False, vertical_flip=False,
+                 brightness=50, contrast=50, sharpness=50, crop=None,
+                 filter=DEFAULT, blur=DEFAULT):
+        self.rotation = rotation
+        self.horizontal_flip = bool(horizontal_flip)
+        self.vertical_flip = bool(vertical_flip)
+        self.brightness = brightness
+        self.contrast = contrast
+        self.sharpness = sharpness
+        self.crop = dict(crop) if crop else {'left': 0, 'right': 0, 'top': 0, 'bottom': 0}
+        self.filter = filter
+        self.blur = blur
+
+    @staticmethod
+    def from_record(record):
+        """Состояние из словаря с полями RECORD_FIELDS (столбцы таблиц HistoryHandler)"""
+        crop = {side: record.get(f'crop_{side}', 0) for side in ('left', 'right', 'top', 'bottom')}
+        return EditState(record.get('rotation', 0), record.get('horizontal_flip', False),
+                         record.get('vertical_flip', False), record.get('brightness', 50),
+                         record.get('contrast', 50), record.get('sharpness', 50), crop,
+                         record.get('filter', DEFAULT), record.get('blur', DEFAULT))
+
+    def record(self):
+        return {'rotation': self.rotation, 'horizontal_flip': self.horizontal_flip,
+                'vertical_flip': self.vertical_flip, 'brightness': self.brightness,
+                'contrast': self.contrast, 'sharpness': self.sharpness,
+                'crop_left': self.crop['left'], 'crop_right': self.crop['right'],
+                'crop_top': self.crop['top'], 'crop_bottom': self.crop['bottom'],
+                'filter': self.filter, 'blur': self.blur}
+
+    def key(self):
+        """Хешируемое представление состояния"""
+        record = self.record()
+        return tuple(record[field] for field in RECORD_FIELDS)
+
+
+def load_image(filename):
+    """Полностью декодирует файл и приводит его к RGB/RGBA"""
+    image = Image.open(filename)
+    image.load()
+    return _rgb(image)
+
+
+def load_preview(filename, width, height):
+    """Изображение, вписанное в width x height, и размеры исходного файла.
+    JPEG сразу декодируется в масштабе 1/2, 1/4 или 1/8, не меньшем width x height,
+    остальные форматы перед вписыванием уменьшаются в степень двойки раз через reduce"""
+    image = Image.open(filename)
+    size = image.size
+    image = _reduced(image, *TransposeHandler.fit_size(*size, width, height))
+    return TransposeHandler.fit(_rgb(image), width, height), size
+
+
+def load_reduced(filename, width, height):
+    """Файл, уменьшенный как в load_preview, но без вписывания: не меньше width x height"""
+    return _rgb(_reduced(Image.open(filename), width, height))
+
+
+def _reduced(image, width, height):
+    image.draft(None, (width, height))
+    image.load()
+    factor = min(image.width // width, image.height // height)
+    if factor >= 2:
+        image = image.reduce(1 << factor.bit_length() - 1)
+    return image
+
+
+def _rgb(image):
+    if image.mode in ('RGB', 'RGBA'):
+        return image
+    if image.mode in ('LA', 'PA') or 'transparency' in image.info:
+        return image.convert('RGBA')
+    return image.convert('RGB')
+
+
+class StageCache:
+    """Результаты этапов конвейера с вытеснением давно не использованных
+    при превышении limit байт"""
+
+    def __init__(self, limit=CACHE_LIMIT):
+        self.limit = limit
+        self.size = 0
+        self.images = OrderedDict()
+
+    def get(self, key):
+        image = self.images.get(key)
+        if image is not None:
+            self.images.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        if key in self.images:
+            return
+        self.images[key] = image
+        self.size += _image_bytes(image)
+        while self.size > self.limit and len(self.images) > 1:
+            self.size -= _image_bytes(self.images.popitem(last=False)[1])
+
+    def clear(self):
+        self.images.clear()
+        self.size = 0
+
+
+def render(image: Image.Image, state: EditState, fit=None, filters=FILTERS, blurs=BLURS, cache=None,
+           cancelled=None, profiler=None):
+    """Применяет state к image. fit - размеры области просмотра (ширина, высота),
+    для экспорта в полном разрешении передается None.
+    С cache пересчитываются только этапы, параметры которых изменились.
+    Если cancelled() между этапами вернет True, возвращается None.
+    profiler - profiling.Profiler, замеряющий каждый этап"""
+    stages = _stages(state, fit, filters, blurs)
+    keys = []
+    key = (id(image), image.size)
+    for name, params, _ in stages:
+        key = (name, params, key)
+        keys.append(key)
+
+    start = 0
+    if cache is not None:
+        for i in range(len(keys) - 1, -1, -1):
+            cached = cache.get(keys[i])
+            if cached is not None:
+                image, start = cached, i + 1
+                break
+
+    for (name, _, func), key in zip(stages[start:], keys[start:]):
+        if cancelled is not None and cancelled():
+            return None
+        image = func(image) if profiler is None else profiler.call(name, func, image)
+        if cache is not None:
+            cache.put(key, image)
+    return image
+
+
+def _stages(state, fit, filters, blurs):
+    """Этапы конвейера: название, параметры, от которых зависит результат, и функция"""
+    filter_func = filters.get(state.filter, default_image)
+    blur_func = blurs.get(state.blur, default_image)
+    stages = [('geometry', (tuple(state.crop.items()), state.rotation, state.horizontal_flip,
+                            state.vertical_flip, fit), lambda image: _geometry(image, state, fit))]
+    if _fused(state, filter_func):
+        stages.append(('color', (state.brightness, state.contrast, state.filter, filter_func),
+                       lambda image: adjust_and_filter(image, state, filter_func)))
+    else:
+        stages += [('adjustment', (state.brightness, state.contrast, state.sharpness),
+                    lambda image: _adjustment(image, state)),
+                   ('filter', (state.filter, filter_func), filter_func)]
+    stages.append(('blur', (state.blur, blur_func), blur_func))
+    return stages
+
+
+def adjust_and_filter(image, state, filter_func, histogram=None):
+    """Коррекция и фильтр state. Если фильтр - 3D LUT, а резкость не меняется, таблица уровней
+    яркости и контраста запекается в его таблицу, и оба этапа занимают один проход.
+    histogram - image.histogram() всего изображения, если image - его часть"""
+    if _fused(state, filter_func):
+        levels = AdjustmentHandler.levels(image, state.brightness, state.contrast, histogram)
+        return filter_func(image) if levels is None else image.filter(bake(levels, filter_func))
+    return filter_func(AdjustmentHandler.adjust(image, state.brightness, state.contrast, state.sharpness,
+                                                histogram))
+
+
+def _fused(state, filter_func):
+    # Встроенные фильтры и таблица уровней через Image.point быстрее трилинейной интерполяции,
+    # запекание выигрывает, только когда фильтр и так проходит по 3D LUT
+    return state.sharpness == 50 and isinstance(filter_func, LutFilter)
+
+
+def _geometry(image, state, fit):
+    return TransposeHandler.geometry(image, state.crop, state.rotation,
+                                     state.horizontal_flip, state.vertical_flip, fit)
+
+
+def _adjustment(image, state):
+    return AdjustmentHandler.adjust(image, state.brightness, state.contrast, state.sharpness)
+
+
+def _image_bytes(image):
+    return image.width * image.height * len(image.getbands())
@@ -0,0 +1,146 @@
+import atexit
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+from kernels import MIN_TILE_ROWS
+
+# Фильтр, который на всем изображении займет меньше этого времени, выполняется в текущем процессе:
+# копирование в общую память и запуск задач обойдутся дороже
+PROCESS_SECONDS = 0.05
+# Сколько строк изображения обрабатывается пробно, чтобы оценить время фильтра
+SAMPLE_ROWS = 8
+# Сколько строк в проверочном образце из шума: его половины сравниваются с образцом целиком
+CHECK_ROWS = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ProcessFilter:
+    """Обычный фильтр над PIL.Image.Image, который выполняется по полосам в постоянном пуле процессов.
+    Циклы на чистом Python держат GIL, и потоки их не ускоряют. Пиксели лежат в
+    multiprocessing.shared_memory, процессы читают свою полосу и пишут результат на место,
+    по каналам передаются только имена блоков памяти и номера строк.
+    По полосам фильтр выполняется по тому же правилу, что и в stream.tileable;
+    halo - сколько соседних строк нужно для каждой строки результата. Фильтр без атрибута tileable
+    при первом вызове проверяется на образце из шума: результат его половин должен совпасть с результатом
+    целого образца, иначе фильтр выполняется над всем изображением. pointwise передается lut.is_pointwise.
+    Быстрые фильтры, фильтры, меняющие размер или режим изображения, и фильтры, которые нельзя
+    передать в другой процесс (lambda, замыкания), выполняются как обычно"""
+
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+        self.halo = getattr(func, 'halo', 0)
+        self.pointwise = getattr(func, 'pointwise', False)
+        # None - неизвестно, выясняется в parallel
+        self.tileable = getattr(func, 'tileable', True if self.pointwise else None)
+        self.seconds_per_pixel = None
+        try:
+            pickle.dumps(func)
+            self.picklable = True
+        except (pickle.PicklingError, AttributeError, TypeError):
+            self.picklable = False
+
+    def __call__(self, image: Image.Image):
+        if not self.parallel(image):
+            return self.func(image)
+        result = self.run_tiles(image)
+        return self.func(image) if result is None else result
+
+    def parallel(self, image):
+        """Стоит ли обрабатывать image в пуле процессов"""
+        if (not self.picklable or self.tileable is False or os.cpu_count() < 2
+                or image.height < 2 * MIN_TILE_ROWS):
+            return False
+        if self.seconds_per_pixel is None:
+            sample = image.crop((0, 0, image.width, min(SAMPLE_ROWS, image.height)))
+            start = time.perf_counter()
+            self.func(sample)
+            self.seconds_per_pixel = (time.perf_counter() - start) / (sample.width * sample.height)
+        if self.seconds_per_pixel * image.width * image.height <= PROCESS_SECONDS:
+            return False
+        if self.tileable is None:
+            self.tileable = self.tiles_match(image.width, image.mode)
+        return self.tileable
+
+    def tiles_match(self, width, mode):
+        """Совпадает ли результат двух половин образца из шума с результатом целого образца.
+        На шуме отражения, размытия и зависимость от положения строки видны, даже если
+        у самого изображения первые строки одинаковые"""
+        pixels = np.random.default_rng(0).integers(0, 256, (CHECK_ROWS, width, len(mode)), np.uint8)
+        sample = Image.fromarray(pixels, mode)
+        middle = CHECK_ROWS // 2 + 1
+        tiles = [self.func(sample.crop((0, 0, width, middle))), self.func(sample.crop((0, middle, width, CHECK_ROWS)))]
+        result = self.func(sample)
+        if result.size != sample.size or any(tile.mode != result.mode or tile.width != width for tile in tiles):
+            return False
+        return np.array_equal(np.vstack([np.asarray(tile) for tile in tiles]), np.asarray(result))
+
+    def run_tiles(self, image):
+        """Результат по полосам или None, если фильтр изменил размеры или режим полосы"""
+        pixels = np.asarray(image)
+        shape = pixels.shape
+        height = shape[0]
+        rows = max(-(-height // os.cpu_count()), MIN_TILE_ROWS)
+        source = shared_memory.SharedMemory(create=True, size=pixels.nbytes)
+        target = shared_memory.SharedMemory(create=True, size=pixels.nbytes)
+        try:
+            np.ndarray(pixels.shape, np.uint8, source.buf)[:] = pixels
+            del pixels
+            futures = [_pool().submit(_run_tile, self.func, source.name, target.name, shape,
+                                      top, min(top + rows, height), self.halo)
+                       for top in range(0, height, rows)]
+            # Память освобождается, только когда закончат все полосы
+            if not all([future.result() for future in futures]):
+                return None
+            result = np.ndarray(shape, np.uint8, target.buf)
+            image = Image.fromarray(result.copy())
+            del result
+            return image
+        finally:
+            for memory in (source, target):
+                memory.close()
+                memory.unlink()
+
+
+def _run_tile(func, source_name, target_name, shape, top, bottom, halo):
+    """Выполняется в процессе пула: func над строками top..bottom с запасом halo,
+    результат записывается в те же строки target. False, если результат другой формы"""
+    # Процессы пула используют resource_tracker редактора, блоки удаляет только создавший их процесс
+    source, target = shared_memory.SharedMemory(source_name), shared_memory.SharedMemory(target_name)
+    try:
+        pixels = np.ndarray(shape, np.uint8, source.buf)
+        start, end = max(top - halo, 0), min(bottom + halo, shape[0])
+        tile = Image.fromarray(pixels[start:end].copy())
+        del pixels
+        result = np.asarray(func(tile))
+        if result.shape != (end - start,) + tuple(shape[1:]) or result.dtype != np.uint8:
+            return False
+        output = np.ndarray(shape, np.uint8, target.buf)
+        output[top:bottom] = result[top - start:bottom - start]
+        del output
+        return True
+    finally:
+        source.close()
+        target.close()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: процесс редактора многопоточный, fork из него может унаследовать занятые блокировки
+            _executor = ProcessPoolExecutor(os.cpu_count(), multiprocessing.get_context('spawn'))
+            # Пул закрывается до очистки модулей при выходе, иначе его сборка обращается к уже удаленным
+            atexit.register(_executor.shutdown)
+        return _executor
@@ -0,0 +1,90 @@
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+from PIL import Image
+
+# Включает профилирование при запуске, если переменная окружения не пуста
+PROFILE_ENV = 'PHOTO_EDITOR_PROFILE'
+LOG_FILE = 'profile.log'
+LOG_BYTES = 1024 * 1024
+LOG_BACKUPS = 3
+TRACE_FILE = 'profile_trace.json'
+# Сколько последних замеров хранится для экспорта трассы
+TRACE_EVENTS = 10_000
+# Порядок этапов в строке состояния
+STAGES = ('normalize', 'geometry', 'adjustment', 'filter', 'color', 'blur', 'qimage', 'pixmap', 'history')
+
+
+class Profiler:
+    """Время и выделенная память по этапам обработки.
+    Память - пик Python/NumPy-выделений за время этапа (tracemalloc) плюс размер
+    изображения-результата, которое выделяет PIL.
+    Пик tracemalloc общий для процесса, поэтому замеры из потока рендера и главного потока
+    выполняются по очереди, и в каждый попадают только выделения своего этапа.
+    Каждый замер пишется строкой JSON в ротируемый LOG_FILE и хранится для export_trace.
+    Когда профилирование выключено, вместо объекта Profiler передается None"""
+
+    def __init__(self, log_file=LOG_FILE):
+        self.latest = {}
+        self.events = deque(maxlen=TRACE_EVENTS)
+        self.lock = threading.Lock()
+        # Этап может вызвать другой замеряемый этап в том же потоке
+        self.measuring = threading.RLock()
+        self.origin = time.perf_counter()
+        self.logger = logging.getLogger('photo_editor.profile')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=LOG_BYTES, backupCount=LOG_BACKUPS,
+                                                            encoding='utf-8')
+        self.logger.addHandler(self.handler)
+        tracemalloc.start()
+
+    def call(self, stage, func, *args, **kwargs):
+        """Вызывает func(*args, **kwargs) и записывает замер этапа stage"""
+        with self.measuring:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            seconds = time.perf_counter() - start
+            allocated = tracemalloc.get_traced_memory()[1] - before
+        # Этап, которому нечего менять, возвращает то же изображение и ничего не выделяет
+        if isinstance(result, Image.Image) and not any(result is arg for arg in args):
+            allocated += result.width * result.height * len(result.getbands())
+        self.record(stage, start, seconds, allocated)
+        return result
+
+    def record(self, stage, start, seconds, allocated):
+        thread = threading.current_thread().name
+        with self.lock:
+            self.latest[stage] = (seconds, allocated)
+            self.events.append({'name': stage, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                'ts': (start - self.origin) * 1e6, 'dur': seconds * 1e6,
+                                'args': {'bytes': allocated, 'thread': thread}})
+        self.logger.info(json.dumps({'stage': stage, 'seconds': seconds, 'bytes': allocated, 'thread': thread},
+                                    ensure_ascii=False))
+
+    def summary(self):
+        """Последние замеры этапов одной строкой, для строки состояния"""
+        with self.lock:
+            latest = dict(self.latest)
+        return ' | '.join(f'{stage} {latest[stage][0] * 1000:.1f} мс {latest[stage][1] / 1024 / 1024:.1f} МБ'
+                          for stage in STAGES if stage in latest)
+
+    def export_trace(self, filename=TRACE_FILE):
+        """Записывает замеры в формате Trace Event (chrome://tracing, Perfetto)"""
+        with self.lock:
+            events = list(self.events)
+        with open(filename, 'w', encoding='utf-8') as file:
+            json.dump({'traceEvents': events}, file)
+
+    def close(self):
+        tracemalloc.stop()
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
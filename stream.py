@@ -0,0 +1,337 @@
+import math
+import os
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from draw import TransposeHandler, BlurHandler, default_image
+from lut import POINTWISE
+from pipeline import FILTERS, BLURS, DEFAULT, adjust_and_filter, load_image, render
+
+# Сколько памяти может занимать обработка одной полосы
+STRIP_BUDGET = 64 * 1024 * 1024
+# Сколько копий полосы одновременно живет во время обработки
+STRIP_COPIES = 8
+# Начиная с этого количества пикселей экспорт идет по полосам
+STREAM_PIXELS = 40_000_000
+# Запас строк для резкости (фильтр 3x3)
+SHARPNESS_HALO = 1
+
+
+def supports(filename, filter_func=None):
+    """Можно ли записывать файл по полосам с фильтром filter_func"""
+    return filename.lower().endswith(('.png', '.ppm')) and tileable(filter_func)
+
+
+def tileable(filter_func):
+    """Можно ли применять filter_func по полосам: встроенные поточечные фильтры и фильтры
+    с атрибутом tileable = True, как kernels.Kernel и lut.LutFilter. Обычным функциям
+    (размытие, отражение) может понадобиться все изображение, они получают его целиком"""
+    return filter_func is None or filter_func in POINTWISE or getattr(filter_func, 'tileable', False)
+
+
+def source_size(filename):
+    """Размеры файла без декодирования. Ограничение PIL на число пикселей не действует:
+    такие файлы как раз и обрабатываются по полосам"""
+    with _unlimited(Image.open, filename) as image:
+        return image.size
+
+
+def render_file(source, target, state, filters=FILTERS, budget=STRIP_BUDGET, compress_level=6, cancelled=None):
+    """Применяет state к файлу source и записывает результат в target по горизонтальным полосам.
+    Результат совпадает с pipeline.render(load_image(source), state).
+    Фильтр должен проходить проверку tileable. compress_level - сжатие zlib для PNG.
+    Если cancelled() между полосами вернет True, недописанный target удаляется"""
+    geometry = _Geometry(_open_source(source), state)
+    writer = _writer(target, *geometry.size, geometry.mode, compress_level)
+    if _render_strips(geometry, state, filters, budget, writer, cancelled):
+        writer.close()
+    else:
+        writer.abort()
+
+
+def render_image(image: Image.Image, state, filters=FILTERS, budget=STRIP_BUDGET, cancelled=None):
+    """pipeline.render(image, state) для экспорта в полном разрешении без промежуточных копий:
+    полосы результата обрабатываются по одной и вставляются в единственный выходной буфер,
+    так что кроме image в памяти одновременно живут только он и несколько полос.
+    Фильтры, которые нельзя применять по полосам, обрабатываются pipeline.render.
+    Если cancelled() между полосами вернет True, возвращается None"""
+    if not tileable(filters.get(state.filter)):
+        return render(image, state, filters=filters, cancelled=cancelled)
+    geometry = _Geometry(image, state)
+    writer = _ImageBuffer(*geometry.size, geometry.mode)
+    if not _render_strips(geometry, state, filters, budget, writer, cancelled):
+        return None
+    return writer.image
+
+
+def render_region(image: Image.Image, state, region, fit=None, filters=FILTERS, histogram=None, cancelled=None,
+                  profiler=None, cache=None):
+    """Часть region (левый, верхний, правый, нижний край) результата pipeline.render(image, state, fit).
+    Обрабатывается только соответствующая часть image с запасом для резкости, размытия и
+    фильтров-ядер. histogram - гистограмма всего результата до коррекции для контраста,
+    достаточно гистограммы уменьшенной копии. Если cancelled() вернет True, возвращается None.
+    profiler - profiling.Profiler: коррекция и фильтр замеряются вместе, этапом color.
+    Фильтр, не прошедший проверку tileable, получает весь кадр: он считается pipeline.render с cache"""
+    filter_func = filters.get(state.filter, default_image)
+    if not tileable(filter_func):
+        result = render(image, state, fit, filters, cache=cache, cancelled=cancelled, profiler=profiler)
+        return None if result is None else result.crop(region)
+    geometry = _Geometry(image, state, fit)
+    width, height = geometry.size
+    halo = _halo(state, filter_func, width, height)
+    left, top, right, bottom = region
+    box = (max(left - halo, 0), max(top - halo, 0), min(right + halo, width), min(bottom + halo, height))
+    steps = [('geometry', lambda _: geometry.region(*box)),
+             ('color', lambda part: adjust_and_filter(part, state, filter_func, histogram))]
+    if state.blur in BLURS and state.blur != DEFAULT:
+        steps.append(('blur', lambda part: BLURS[state.blur](part, frame=(width, height, box[0], box[1]))))
+    part = None
+    for name, step in steps:
+        if cancelled is not None and cancelled():
+            return None
+        part = step(part) if profiler is None else profiler.call(name, step, part)
+    return part.crop((left - box[0], top - box[1], right - box[0], bottom - box[1]))
+
+
+def _halo(state, filter_func, width, height):
+    """Сколько соседних строк и столбцов нужно, чтобы часть результата совпала с целым"""
+    halo = getattr(filter_func, 'halo', 0)
+    if state.sharpness != 50:
+        halo += SHARPNESS_HALO
+    if state.blur in BLURS and state.blur != DEFAULT:
+        halo += BlurHandler.halo(width, height)
+    return halo
+
+
+def _render_strips(geometry, state, filters, budget, writer, cancelled=None):
+    """Записывает результат полосами в writer, возвращает False, если обработку отменили"""
+    width, height = geometry.size
+    rows = max(budget // (max(width, height) * 4 * STRIP_COPIES), 1)
+
+    filter_func = filters.get(state.filter, default_image)
+    halo = _halo(state, filter_func, width, height)
+
+    histogram = None
+    if state.contrast != 50:
+        histogram = [0] * 256 * len(geometry.mode)
+        for top in range(0, height, rows):
+            strip = geometry.strip(top, min(top + rows, height))
+            histogram = [a + b for a, b in zip(histogram, strip.histogram())]
+
+    for top in range(0, height, rows):
+        if cancelled is not None and cancelled():
+            return False
+        bottom = min(top + rows, height)
+        start, end = max(top - halo, 0), min(bottom + halo, height)
+        strip = geometry.strip(start, end)
+        strip = adjust_and_filter(strip, state, filter_func, histogram)
+        if state.blur in BLURS and state.blur != DEFAULT:
+            strip = BLURS[state.blur](strip, frame=(width, height, 0, start))
+        strip = strip.crop((0, top - start, width, bottom - start))
+        writer.write(strip)
+    return True
+
+
+def _open_source(filename):
+    """Источник для _Geometry. Несжатые файлы (PPM, BMP, TIFF без сжатия) отображаются в память
+    массивом (высота, ширина, каналы) без декодирования, остальные форматы декодируются целиком"""
+    image = _unlimited(Image.open, filename)
+    if image.mode in ('RGB', 'RGBA') and len(image.tile) == 1:
+        decoder, extents, offset, args = image.tile[0]
+        if isinstance(args, str):
+            args = (args, 0, 1)
+        rawmode, stride, orientation = args
+        width, height = image.size
+        channels = len(image.mode)
+        if (decoder == 'raw' and extents == (0, 0, width, height) and orientation in (1, -1)
+                and rawmode in (image.mode, image.mode.replace('RGB', 'BGR'))):
+            stride = stride or width * channels
+            image.close()
+            pixels = np.memmap(filename, np.uint8, 'r', offset, (height, stride))
+            pixels = pixels[:, :width * channels].reshape(height, width, channels)
+            if orientation == -1:
+                pixels = pixels[::-1]
+            if rawmode.startswith('BGR'):
+                pixels = pixels[:, :, [2, 1, 0, 3][:channels]]
+            return pixels
+    image.close()
+    return _unlimited(load_image, filename)
+
+
+def _unlimited(func, *args):
+    """func(*args) без защиты PIL от слишком больших изображений"""
+    limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, None
+    try:
+        return func(*args)
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+
+class _Geometry:
+    """Геометрия из TransposeHandler.geometry как обратное аффинное преобразование,
+    которое можно применить к любой полосе строк или прямоугольнику результата.
+    source - массив (высота, ширина, каналы) или изображение RGB/RGBA"""
+
+    def __init__(self, source, state, fit=None):
+        self.source = source
+        if isinstance(source, Image.Image):
+            width, height = source.size
+            self.mode = source.mode
+        else:
+            height, width, channels = source.shape
+            self.mode = 'RGBA' if channels == 4 else 'RGB'
+        self.source_size = width, height
+        box = self.box = TransposeHandler.crop_box(width, height, state.crop)
+        self.size, matrix = TransposeHandler.affine(box[2] - box[0], box[3] - box[1], state.rotation,
+                                                    state.horizontal_flip, state.vertical_flip, fit)
+        a, b, c, d, e, f = matrix
+        self.matrix = a, b, c + box[0], d, e, f + box[1]
+        # Повороты на кратный 90° угол переставляют пиксели без интерполяции
+        self.resample = Image.NEAREST if state.rotation % 90 == 0 else Image.BICUBIC
+        self.transpose = None
+        if state.rotation % 90 == 0:
+            self.transpose = TransposeHandler.transpose_method(state.rotation, state.horizontal_flip,
+                                                               state.vertical_flip)
+
+    def strip(self, top, bottom):
+        width = self.size[0]
+        a, b, c, d, e, f = self.matrix
+        xs = [a * x + b * y + c for x in (0, width) for y in (top, bottom)]
+        ys = [d * x + e * y + f for x in (0, width) for y in (top, bottom)]
+        x0, y0 = max(math.floor(min(xs)) - 3, self.box[0]), max(math.floor(min(ys)) - 3, self.box[1])
+        x1, y1 = min(math.ceil(max(xs)) + 3, self.box[2]), min(math.ceil(max(ys)) + 3, self.box[3])
+        if x0 >= x1 or y0 >= y1:
+            return Image.new(self.mode, (width, bottom - top))
+        return self.window(x0, y0, x1, y1).transform((width, bottom - top), Image.AFFINE,
+                                                     (a, b, c + b * top - x0, d, e, f + e * top - y0),
+                                                     self.resample)
+
+    def region(self, left, top, right, bottom):
+        """Прямоугольник результата, как та же часть TransposeHandler.geometry(..., fit):
+        при повороте на кратный 90° угол - resize части исходного изображения и transpose,
+        иначе - аффинное преобразование части обрезанного изображения"""
+        a, b, c, d, e, f = self.matrix
+        xs = [a * x + b * y + c for x in (left, right) for y in (top, bottom)]
+        ys = [d * x + e * y + f for x in (left, right) for y in (top, bottom)]
+        # Запас на носитель бикубического ядра с учетом уменьшения
+        margin = math.ceil(2 * max(abs(a), abs(b), abs(d), abs(e))) + 2
+        if self.transpose is None and self.resample == Image.BICUBIC:
+            x0, y0 = max(math.floor(min(xs)) - margin, self.box[0]), max(math.floor(min(ys)) - margin, self.box[1])
+            x1, y1 = min(math.ceil(max(xs)) + margin, self.box[2]), min(math.ceil(max(ys)) + margin, self.box[3])
+            if x0 >= x1 or y0 >= y1:
+                return Image.new(self.mode, (right - left, bottom - top))
+            return self.window(x0, y0, x1, y1).transform((right - left, bottom - top), Image.AFFINE,
+                                                         (a, b, c + a * left + b * top - x0,
+                                                          d, e, f + d * left + e * top - y0), Image.BICUBIC)
+
+        size = (right - left, bottom - top)
+        if self.transpose in (Image.ROTATE_90, Image.ROTATE_270, Image.TRANSPOSE, Image.TRANSVERSE):
+            size = size[::-1]
+        # Как resize(size, box=...) во TransposeHandler.geometry, ядро берет пиксели и за краем обрезки
+        x0, y0 = max(math.floor(min(xs)) - margin, 0), max(math.floor(min(ys)) - margin, 0)
+        x1 = min(math.ceil(max(xs)) + margin, self.source_size[0])
+        y1 = min(math.ceil(max(ys)) + margin, self.source_size[1])
+        # Погрешность вычислений не должна выводить рамку за края окна
+        box = (max(min(xs) - x0, 0), max(min(ys) - y0, 0), min(max(xs) - x0, x1 - x0), min(max(ys) - y0, y1 - y0))
+        part = self.window(x0, y0, x1, y1).resize(size, box=box)
+        return part if self.transpose is None else part.transpose(self.transpose)
+
+    def window(self, x0, y0, x1, y1):
+        if isinstance(self.source, Image.Image):
+            # Окно повернутой полосы большого файла может быть больше ограничения PIL
+            return _unlimited(self.source.crop, (x0, y0, x1, y1))
+        return Image.fromarray(np.ascontiguousarray(self.source[y0:y1, x0:x1]))
+
+
+def _writer(filename, width, height, mode, compress_level=6):
+    if filename.lower().endswith('.png'):
+        return _PngWriter(filename, width, height, mode, compress_level)
+    if filename.lower().endswith('.ppm') and mode == 'RGB':
+        return _PpmWriter(filename, width, height)
+    return _ImageWriter(filename, width, height, mode)
+
+
+class _FileWriter:
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'wb')
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.filename)
+
+
+class _PngWriter(_FileWriter):
+    def __init__(self, filename, width, height, mode, compress_level=6):
+        super().__init__(filename)
+        self.compressor = zlib.compressobj(compress_level)
+        self.previous = None
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        color_type = 6 if mode == 'RGBA' else 2
+        self.chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+
+    def write(self, strip):
+        pixels = np.asarray(strip)
+        rows = pixels.reshape(pixels.shape[0], -1)
+        previous = np.vstack([rows[:1] if self.previous is None else self.previous, rows[:-1]])
+        # Фильтр Up: разность с предыдущей строкой, первой строке файла соответствует фильтр None
+        filtered = np.empty((rows.shape[0], rows.shape[1] + 1), np.uint8)
+        filtered[:, 0] = 2
+        filtered[:, 1:] = rows - previous
+        if self.previous is None:
+            filtered[0, 0] = 0
+            filtered[0, 1:] = rows[0]
+        self.previous = rows[-1:].copy()
+        data = self.compressor.compress(filtered.tobytes())
+        if data:
+            self.chunk(b'IDAT', data)
+
+    def close(self):
+        self.chunk(b'IDAT', self.compressor.flush())
+        self.chunk(b'IEND', b'')
+        self.file.close()
+
+    def chunk(self, kind, data):
+        self.file.write(struct.pack('>I', len(data)) + kind + data)
+        self.file.write(struct.pack('>I', zlib.crc32(kind + data)))
+
+
+class _PpmWriter(_FileWriter):
+    def __init__(self, filename, width, height):
+        super().__init__(filename)
+        self.file.write(b'P6\n%d %d\n255\n' % (width, height))
+
+    def write(self, strip):
+        self.file.write(strip.tobytes())
+
+    def close(self):
+        self.file.close()
+
+
+class _ImageBuffer:
+    """Собирает полосы в одно изображение"""
+
+    def __init__(self, width, height, mode):
+        self.image = Image.new(mode, (width, height))
+        self.top = 0
+
+    def write(self, strip):
+        self.image.paste(strip, (0, self.top))
+        self.top += strip.height
+
+    def abort(self):
+        pass
+
+
+class _ImageWriter(_ImageBuffer):
+    """Для остальных форматов полосы собираются в одно изображение и сохраняются через PIL"""
+
+    def __init__(self, filename, width, height, mode):
+        super().__init__(width, height, mode)
+        self.filename = filename
+
+    def close(self):
+        self.image.save(self.filename)
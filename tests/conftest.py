@@ -0,0 +1,56 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+# Модули редактора лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stream  # noqa: E402
+
+
+def gaussian_blur(image: Image.Image):
+    return image.filter(ImageFilter.GaussianBlur(6))
+
+
+def flip(image: Image.Image):
+    return image.transpose(Image.FLIP_TOP_BOTTOM)
+
+
+@pytest.fixture
+def random_image():
+    """random_image(width, height, mode='RGB', seed=0) - изображение из случайных пикселей"""
+    def make(width, height, mode='RGB', seed=0):
+        pixels = np.random.default_rng(seed).integers(0, 256, (height, width, len(mode)), np.uint8)
+        return Image.fromarray(pixels, mode)
+
+    return make
+
+
+@pytest.fixture
+def gradient():
+    """gradient(width, height) - изображение, которое хорошо сжимается в PNG"""
+    def make(width, height):
+        rows, columns = np.indices((height, width))
+        return Image.fromarray(np.stack([rows % 256, columns % 256, (rows + columns) % 256], -1).astype(np.uint8))
+
+    return make
+
+
+@pytest.fixture
+def large_source(tmp_path, monkeypatch, gradient):
+    """PNG 2000 x 1500, который больше ограничения PIL на число пикселей и порога записи по полосам.
+    Ограничение уменьшено так, что файл больше него, а полосы - нет"""
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1_200_000)
+    monkeypatch.setattr(stream, 'STREAM_PIXELS', 1_000_000)
+    source = tmp_path / 'source.png'
+    gradient(2000, 1500).save(source, compress_level=1)
+    return str(source)
+
+
+@pytest.fixture(params=[gaussian_blur, flip])
+def plain_plugin(request):
+    """Обычные фильтры из модуля, которые нельзя применять по полосам"""
+    return request.param
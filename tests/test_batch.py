@@ -0,0 +1,17 @@
+"""Пакетная обработка"""
+import numpy as np
+from PIL import Image
+
+import batch
+from pipeline import EditState, load_image, render
+
+
+def test_large_file_is_streamed(tmp_path, monkeypatch, large_source):
+    target = tmp_path / 'target.png'
+    state = EditState(rotation=15, contrast=70, filter='Сепия')
+    result = batch.process((large_source, str(target), state))
+    assert result[3] is None
+    assert result[1] == 2000 * 1500
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', None)
+    with Image.open(target) as image:
+        assert np.array_equal(np.asarray(image), np.asarray(render(load_image(large_source), state)))
@@ -0,0 +1,26 @@
+"""Кадры для показа"""
+import numpy as np
+
+import stream
+from display import render_frame
+from levels import Histograms
+from pipeline import EditState, render
+
+
+def test_render_frame_counts_histograms(random_image):
+    image = random_image(320, 240)
+    histograms = Histograms(image)
+    state = EditState(brightness=70, filter='Сепия')
+    frame = render_frame(image, state, fit=(200, 200), histograms=histograms)
+    assert frame.image.size == render(image, state, fit=(200, 200)).size
+    assert np.array_equal(frame.counts, histograms.output(state))
+
+
+def test_region_contrast_uses_whole_frame_histogram(random_image):
+    image = random_image(320, 240)
+    state = EditState(contrast=80)
+    region = (40, 30, 200, 150)
+    frame = render_frame(image, state, region, histograms=Histograms(image), renderer=stream.render_region)
+    expected = stream.render_region(image, state, region, histogram=Histograms(image).source(state))
+    assert np.array_equal(np.asarray(frame.image), np.asarray(expected))
+    assert frame.counts is not None
@@ -0,0 +1,83 @@
+"""Экспорт вариантов"""
+import weakref
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from export import THUMBNAIL_SIDE, Variant, default_variants, export
+from pipeline import EditState, load_image, render
+
+
+def test_full_size_variant_is_written_by_strips(tmp_path, monkeypatch, large_source):
+    state = EditState(rotation=15, contrast=70)
+    names = export(large_source, state, str(tmp_path / 'result.png'), [Variant()])
+    assert names == [str(tmp_path / 'result.png')]
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', None)
+    with Image.open(names[0]) as image:
+        assert np.array_equal(np.asarray(image), np.asarray(render(load_image(large_source), state)))
+
+
+def full_size_peak(monkeypatch, width, height):
+    """Считает, сколько новых изображений не меньше width x height живет одновременно"""
+    alive = []
+    peak = [0]
+    new = Image.Image._new
+
+    def tracked(self, core):
+        image = new(self, core)
+        if image.width * image.height >= width * height:
+            alive.append(weakref.ref(image))
+            peak[0] = max(peak[0], sum(ref() is not None for ref in alive))
+        return image
+
+    monkeypatch.setattr(Image.Image, '_new', tracked)
+    return peak
+
+
+def test_full_size_export_allocates_one_buffer(tmp_path, monkeypatch, gradient):
+    # Кроме исходного изображения в памяти только выходной буфер: при STRIP_BUDGET кадр
+    # делится на несколько полос, и каждое окно исходника меньше него
+    image = gradient(2000, 1500)
+    source = tmp_path / 'source.png'
+    image.save(source, compress_level=1)
+    state = EditState(rotation=15, contrast=80, sharpness=70, filter='Сепия', blur='Горизонтальное размытие')
+    peak = full_size_peak(monkeypatch, *image.size)
+    names = export(str(source), state, str(tmp_path / 'result.png'), [Variant()], image=image)
+    assert peak[0] == 1
+    monkeypatch.undo()
+    with Image.open(names[0]) as result:
+        assert np.array_equal(np.asarray(result), np.asarray(render(image, state)))
+
+
+def test_streamed_export_allocates_no_buffer(tmp_path, monkeypatch, large_source):
+    state = EditState(rotation=15, contrast=80, filter='Сепия')
+    peak = full_size_peak(monkeypatch, 2000, 1500)
+    export(large_source, state, str(tmp_path / 'result.png'), [Variant()])
+    assert peak[0] == 0
+
+
+def test_smaller_variants_of_streamed_file_are_decoded_reduced(tmp_path, monkeypatch, large_source):
+    monkeypatch.setattr('export.WEB_SIDE', 700)
+    state = EditState(rotation=15, contrast=70)
+    names = export(large_source, state, str(tmp_path / 'result.png'), default_variants())
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', None)
+    sizes = []
+    for name in names:
+        with Image.open(name) as image:
+            sizes.append(max(image.size))
+    assert sizes == [max(render(load_image(large_source), state).size), 700, THUMBNAIL_SIDE]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['result.png', 'result_thumb.jpg',
+                                                               'result_web.jpg', 'source.png']
+
+
+def test_failed_export_removes_parts(tmp_path, monkeypatch, large_source):
+    monkeypatch.setattr('export.WEB_SIDE', 700)
+
+    def replace(source, target):
+        raise OSError('диск заполнен')
+
+    monkeypatch.setattr('os.replace', replace)
+    with pytest.raises(OSError):
+        export(large_source, EditState(), str(tmp_path / 'result.png'), default_variants())
+    assert [path.name for path in tmp_path.iterdir()] == ['source.png']
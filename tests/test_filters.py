@@ -0,0 +1,93 @@
+"""Векторные фильтры против исходных циклов по пикселям"""
+import numpy as np
+import pytest
+from PIL import Image
+
+import filter as plugin
+from draw import FilterHandler
+
+SIZES = [(1, 1), (37, 23), (64, 48)]
+
+
+def loop_black_white(image: Image.Image):
+    res = image.copy()
+    pixels = res.load()
+    for i in range(res.width):
+        for j in range(res.height):
+            color = sum(pixels[i, j]) // 3
+            pixels[i, j] = (color, color, color)
+    return res
+
+
+def loop_sepia(image: Image.Image, k=30):
+    res = image.copy()
+    pixels = res.load()
+    for i in range(image.width):
+        for j in range(image.height):
+            color = sum(pixels[i, j]) // 3
+            pixels[i, j] = (color + k ** 2, color + k, color)
+    return res
+
+
+def loop_some_filter(image: Image.Image):
+    res = image.copy()
+    pixels = res.load()
+    for i in range(res.width):
+        for j in range(res.height):
+            r, g, b = pixels[i, j]
+            pixels[i, j] = r // 2, g * 2, b * 2
+    return res
+
+
+def loop_another_filter(image: Image.Image):
+    res = image.copy()
+    pixels = res.load()
+    for i in range(res.width):
+        for j in range(res.height):
+            r, g, b = pixels[i, j]
+            pixels[i, j] = r // 2, g // 2, b * 2
+    return res
+
+
+def assert_same(result, expected):
+    assert result.mode == expected.mode
+    assert result.size == expected.size
+    assert np.array_equal(np.asarray(result), np.asarray(expected))
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('size', SIZES)
+def test_black_white(random_image, size, mode):
+    image = random_image(*size, mode)
+    assert_same(FilterHandler.black_white(image), loop_black_white(image))
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('size', SIZES)
+def test_sepia(random_image, size, mode):
+    image = random_image(*size, mode, seed=1)
+    assert_same(FilterHandler.sepia(image), loop_sepia(image))
+
+
+@pytest.mark.parametrize('k', [0, 5, 30])
+def test_sepia_clipping(random_image, k):
+    # k ** 2 выводит красный канал за 255 уже при k = 16
+    image = random_image(37, 23, seed=2)
+    assert_same(FilterHandler.sepia(image, k), loop_sepia(image, k))
+
+
+def test_sepia_extremes():
+    image = Image.fromarray(np.array([[[0, 0, 0], [255, 255, 255], [255, 0, 0]]], np.uint8))
+    assert_same(FilterHandler.sepia(image), loop_sepia(image))
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_some_filter(random_image, size):
+    image = random_image(*size, seed=3)
+    assert_same(plugin.some_filter(image), loop_some_filter(image))
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_another_filter(random_image, size):
+    image = random_image(*size, seed=4)
+    assert_same(plugin.another_filter(image), loop_another_filter(image))
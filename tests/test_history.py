@@ -0,0 +1,29 @@
+"""Фоновая запись истории"""
+import sqlite3
+import sys
+import time
+
+from history import HistoryWriter, connect
+
+
+def test_writer_survives_sqlite_error(tmp_path, monkeypatch):
+    errors = []
+    monkeypatch.setattr(sys, 'excepthook', lambda *info: errors.append(info[0]))
+    database = str(tmp_path / 'history.db')
+    writer = HistoryWriter(database)
+    writer.execute('INSERT INTO missing VALUES (1)')
+    writer.close()
+    assert errors == [sqlite3.OperationalError]
+
+    writer = HistoryWriter(database)
+    writer.execute('INSERT INTO missing VALUES (1)')
+    # Следующая транзакция после ошибочной должна выполниться
+    deadline = time.monotonic() + 5
+    while len(errors) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.execute('INSERT INTO history (image, seq) VALUES (?, ?)', ('a', 1))
+    writer.close()
+    assert len(errors) == 2
+    connection = connect(database)
+    assert connection.execute('SELECT image, seq FROM history').fetchall() == [('a', 1)]
+    connection.close()
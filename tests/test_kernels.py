@@ -0,0 +1,34 @@
+"""Фильтры-модули"""
+import threading
+import time
+
+import filter as plugin
+import kernel_filter
+import kernels
+from kernels import Kernel, plugin_filters
+
+
+def test_plugin_filters_skip_imported_names():
+    assert [name for name, _ in plugin_filters(kernel_filter)] == ['emboss_filter', 'warm_filter']
+    assert all(isinstance(func, Kernel) for _, func in plugin_filters(kernel_filter))
+    assert [name for name, _ in plugin_filters(plugin)] == ['another_filter', 'some_filter']
+
+
+def test_pool_is_created_once(monkeypatch):
+    # Kernel вызывается одновременно из потоков миниатюр
+    created = []
+
+    def executor(workers):
+        time.sleep(0.05)
+        created.append(object())
+        return created[-1]
+
+    monkeypatch.setattr(kernels, '_executor', None)
+    monkeypatch.setattr(kernels, 'ThreadPoolExecutor', executor)
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(kernels._pool())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1 and all(pool is created[0] for pool in pools)
@@ -0,0 +1,48 @@
+"""Фильтры из модулей в пуле процессов"""
+import os
+
+import numpy as np
+import pytest
+
+import loop_filter
+import processes
+import stream
+from lut import is_pointwise
+from processes import ProcessFilter
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # Пул запускается и на машине с одним процессором, полос получается несколько,
+    # а время цикла на маленьком изображении не зависит от загрузки машины
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    monkeypatch.setattr(processes, 'PROCESS_SECONDS', 0)
+
+
+def test_plain_plugin_fails_tile_check(pool, plain_plugin):
+    process_filter = ProcessFilter(plain_plugin)
+    assert process_filter.tileable is None
+    assert not process_filter.tiles_match(300, 'RGB')
+    assert not stream.tileable(process_filter)
+
+
+def test_unmarked_loop_filter_runs_in_pool(pool, random_image):
+    image = random_image(400, 300)
+    process_filter = ProcessFilter(loop_filter.loop_filter)
+    assert process_filter.parallel(image) and process_filter.tileable
+    assert stream.tileable(process_filter)
+    assert np.array_equal(np.asarray(process_filter.run_tiles(image)), np.asarray(loop_filter.loop_filter(image)))
+
+
+def test_marked_loop_filter_runs_in_pool(pool, monkeypatch, random_image):
+    monkeypatch.setattr(loop_filter.loop_filter, 'tileable', True, raising=False)
+    image = random_image(400, 300, seed=1)
+    process_filter = ProcessFilter(loop_filter.loop_filter)
+    assert process_filter.tileable and process_filter.halo == 0 and process_filter.parallel(image)
+    assert np.array_equal(np.asarray(process_filter(image)), np.asarray(loop_filter.loop_filter(image)))
+
+
+def test_pointwise_is_forwarded(monkeypatch):
+    monkeypatch.setattr(loop_filter.loop_filter, 'pointwise', True, raising=False)
+    process_filter = ProcessFilter(loop_filter.loop_filter)
+    assert is_pointwise(process_filter) and process_filter.tileable
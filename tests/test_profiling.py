@@ -0,0 +1,48 @@
+"""Замеры этапов"""
+import threading
+import time
+
+from PIL import Image
+
+from display import render_frame
+from pipeline import EditState
+from profiling import Profiler
+
+MEGABYTE = 1024 * 1024
+
+
+def test_concurrent_stages_do_not_share_peak(tmp_path):
+    profiler = Profiler(str(tmp_path / 'profile.log'))
+    started = threading.Event()
+
+    def small():
+        started.set()
+        time.sleep(0.2)
+        return bytearray(1024)
+
+    def large():
+        data = bytearray(20 * MEGABYTE)
+        del data
+
+    try:
+        thread = threading.Thread(target=profiler.call, args=('small', small))
+        thread.start()
+        started.wait()
+        profiler.call('large', large)
+        thread.join()
+        assert profiler.latest['small'][1] < MEGABYTE
+        assert profiler.latest['large'][1] >= 20 * MEGABYTE
+        assert {event['args']['thread'] for event in profiler.events} == {thread.name, 'MainThread'}
+    finally:
+        profiler.close()
+
+
+def test_render_frame_measures_qimage(tmp_path):
+    profiler = Profiler(str(tmp_path / 'profile.log'))
+    try:
+        frame = render_frame(Image.new('RGB', (320, 240)), EditState(), profiler=profiler)
+        assert frame.qimage.width() == 320
+        assert profiler.latest['qimage'][1] >= 320 * 240 * 4
+        assert 'qimage' in profiler.summary()
+    finally:
+        profiler.close()
@@ -0,0 +1,79 @@
+"""Рендер по полосам и частям против pipeline.render"""
+import tracemalloc
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import stream
+from pipeline import FILTERS, EditState, load_image, render
+
+CROP = {'left': 7, 'right': 3, 'top': 11, 'bottom': 5}
+
+
+def difference(first, second):
+    assert first.size == second.size
+    return np.abs(np.asarray(first).astype(int) - np.asarray(second).astype(int)).max()
+
+
+@pytest.mark.parametrize('rotation', [15, 30, -45, 123])
+@pytest.mark.parametrize('contrast', [50, 80])
+@pytest.mark.parametrize('budget', [200_000, 1_000_000])
+def test_render_image_rotation(random_image, rotation, contrast, budget):
+    # Полосы со сдвигом на целое число строк должны давать те же координаты выборки, что и целое изображение
+    image = random_image(903, 701)
+    state = EditState(rotation=rotation, contrast=contrast, crop=CROP, horizontal_flip=rotation == 123)
+    assert difference(stream.render_image(image, state, budget=budget), render(image, state)) == 0
+
+
+@pytest.mark.parametrize('rotation', [0, 90, 15, -33])
+@pytest.mark.parametrize('extension', ['png', 'ppm'])
+def test_render_file(tmp_path, random_image, rotation, extension):
+    source = tmp_path / f'source.{extension}'
+    random_image(131, 97, seed=1).save(source)
+    target = tmp_path / f'target.{extension}'
+    state = EditState(rotation=rotation, brightness=60, contrast=70, sharpness=80, crop=CROP,
+                      filter='Сепия', blur='Горизонтальное размытие')
+    stream.render_file(str(source), str(target), state, budget=20_000)
+    with Image.open(target) as result:
+        assert difference(result, render(load_image(str(source)), state)) == 0
+
+
+@pytest.mark.parametrize('rotation', [0, 90, 15])
+def test_render_region(random_image, rotation):
+    image = random_image(400, 300, seed=2)
+    state = EditState(rotation=rotation, sharpness=80, crop=CROP, blur='Вертикальное размытие')
+    region = (40, 30, 200, 150)
+    part = stream.render_region(image, state, region)
+    assert difference(part, render(image, state).crop(region)) == 0
+
+
+def test_plain_plugin_is_rendered_whole(random_image, plain_plugin):
+    image = random_image(303, 401)
+    filters = {**FILTERS, 'plugin': plain_plugin}
+    state = EditState(rotation=15, filter='plugin')
+    assert not stream.supports('result.png', plain_plugin)
+    assert difference(stream.render_image(image, state, filters, budget=100_000),
+                      render(image, state, filters=filters)) == 0
+
+
+def test_plain_plugin_region_is_cropped_from_whole(random_image, plain_plugin):
+    image = random_image(303, 401)
+    filters = {**FILTERS, 'plugin': plain_plugin}
+    state = EditState(rotation=15, filter='plugin')
+    region = (40, 30, 200, 150)
+    assert difference(stream.render_region(image, state, region, fit=(250, 250), filters=filters),
+                      render(image, state, fit=(250, 250), filters=filters).crop(region)) == 0
+
+
+def test_render_file_keeps_decoded_source(tmp_path, random_image):
+    # Сжатый файл декодируется целиком, но его пиксели не копируются еще раз в массив
+    source = tmp_path / 'source.png'
+    random_image(1000, 800, seed=3).save(source)
+    tracemalloc.start()
+    try:
+        stream.render_file(str(source), str(tmp_path / 'target.png'), EditState(rotation=15), budget=1_000_000)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 1000 * 800 * 3 // 2
@@ -0,0 +1,105 @@
+import math
+
+from PIL import Image
+
+from draw import TransposeHandler
+from pipeline import load_image
+
+# Меньшая сторона самого маленького уровня пирамиды
+PYRAMID_MIN_SIDE = 256
+# Наибольшее увеличение: экранных пикселей на пиксель исходного изображения
+MAX_SCALE = 8
+ZOOM_STEP = 1.25
+# Запас вокруг видимой части при увеличении, в долях области просмотра: небольшой сдвиг не требует рендера
+PAN_MARGIN = 0.25
+
+
+class Pyramid:
+    """Исходное изображение и его копии, уменьшенные в 2, 4, 8... раз"""
+
+    def __init__(self, image: Image.Image):
+        self.levels = [image]
+        while min(self.levels[-1].size) >= 2 * PYRAMID_MIN_SIDE:
+            self.levels.append(self.levels[-1].reduce(2))
+
+    @staticmethod
+    def load(filename):
+        return Pyramid(load_image(filename))
+
+    def level(self, scale):
+        """Самый маленький уровень, на пиксель которого приходится не больше scale экранных пикселей"""
+        index = 0 if scale >= 1 else min(int(math.log2(1 / scale)), len(self.levels) - 1)
+        return self.levels[index]
+
+
+def output_size(size, state, fit=None):
+    """Размеры результата state для изображения размерами size, вписанного в fit"""
+    box = TransposeHandler.crop_box(*size, state.crop)
+    return TransposeHandler.affine(box[2] - box[0], box[3] - box[1], state.rotation,
+                                   state.horizontal_flip, state.vertical_flip, fit)[0]
+
+
+class Viewport:
+    """Масштаб и положение видимой части результата в области просмотра.
+    Размеры и координаты - в экранных пикселях, center - доля ширины и высоты результата"""
+
+    def __init__(self):
+        self.zoom = 1
+        self.center = [0.5, 0.5]
+
+    def reset(self):
+        self.zoom = 1
+        self.center = [0.5, 0.5]
+
+    def display_size(self, output, label):
+        """Размеры всего результата на экране: вписанный в label при zoom = 1"""
+        width, height = TransposeHandler.fit_size(*output, *label)
+        return width * self.zoom, height * self.zoom
+
+    def window(self, output, label):
+        """Видимая часть результата (x, y, ширина, высота) в экранных пикселях от его угла"""
+        display = self.display_size(output, label)
+        window = []
+        for center, shown, side in zip(self.center, display, label):
+            size = min(shown, side)
+            start = min(max(center * shown - size / 2, 0), shown - size)
+            window.append((start, size))
+        return window[0][0], window[1][0], window[0][1], window[1][1]
+
+    def region(self, output, label, frame):
+        """Часть кадра размерами frame, которую нужно отрендерить для текущего вида:
+        видимая часть с запасом PAN_MARGIN, в пикселях кадра"""
+        display = self.display_size(output, label)
+        x, y, width, height = self.window(output, label)
+        scale_x, scale_y = display[0] / frame[0], display[1] / frame[1]
+        margin_x, margin_y = label[0] * PAN_MARGIN, label[1] * PAN_MARGIN
+        return (max(math.floor((x - margin_x) / scale_x), 0), max(math.floor((y - margin_y) / scale_y), 0),
+                min(math.ceil((x + width + margin_x) / scale_x), frame[0]),
+                min(math.ceil((y + height + margin_y) / scale_y), frame[1]))
+
+    def zoom_at(self, factor, position, output, label):
+        """Меняет масштаб в factor раз, оставляя точку результата под position на месте"""
+        display = self.display_size(output, label)
+        x, y, width, height = self.window(output, label)
+        point = [(start + mouse - (side - size) / 2) / shown
+                 for start, mouse, side, size, shown in zip((x, y), position, label, (width, height), display)]
+        base = display[0] / self.zoom
+        self.zoom = min(max(self.zoom * factor, 1), max(MAX_SCALE * output[0] / base, 1))
+        display = self.display_size(output, label)
+        for i in range(2):
+            offset = (label[i] - min(display[i], label[i])) / 2
+            self.center[i] = (point[i] * display[i] - position[i] + offset + label[i] / 2) / display[i]
+        self.clamp(output, label)
+
+    def pan(self, dx, dy, output, label):
+        display = self.display_size(output, label)
+        self.center[0] -= dx / display[0]
+        self.center[1] -= dy / display[1]
+        self.clamp(output, label)
+
+    def clamp(self, output, label):
+        """Центр, при котором видимая часть не выходит за края результата"""
+        display = self.display_size(output, label)
+        for i in range(2):
+            half = min(display[i], label[i]) / 2 / display[i]
+            self.center[i] = min(max(self.center[i], half), 1 - half)
@@ -0,0 +1,196 @@
+import sys
+
+from PyQt5.QtCore import QObject, QRunnable, QThread, QThreadPool, pyqtSignal
+
+
+class RenderSignals(QObject):
+    finished = pyqtSignal(int, object, object)
+
+
+class RenderTask(QRunnable):
+    """Вызывает func(*args, **kwargs, cancelled=...) в потоке из QThreadPool"""
+
+    def __init__(self, generation, key, func, args, kwargs):
+        super().__init__()
+        self.generation = generation
+        self.key = key
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.signals = RenderSignals()
+        self.setAutoDelete(False)
+
+    def run(self):
+        result = None
+        try:
+            result = self.func(*self.args, **self.kwargs, cancelled=lambda: self.cancelled)
+        except Exception:
+            sys.excepthook(*sys.exc_info())
+        self.signals.finished.emit(self.generation, self.key, result)
+
+
+class RenderWorker(QObject):
+    """Фоновый рендер: одновременно выполняется одна задача, из пришедших за это время
+    запросов остается только последний, результаты отмененных задач отбрасываются"""
+    rendered = pyqtSignal(object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.generation = 0
+        self.dropped = 0
+        self.pending = None
+        self.task = None
+
+    def submit(self, key, func, *args, **kwargs):
+        """Запрашивает func(*args, **kwargs, cancelled=...), результат придет в сигнале rendered вместе с key"""
+        self.generation += 1
+        self.pending = (self.generation, key, func, args, kwargs)
+        if self.task is None:
+            self.start_pending()
+
+    def cancel(self):
+        """Отменяет текущую и ожидающую задачи, например при открытии другого файла"""
+        self.dropped = self.generation
+        self.pending = None
+        if self.task is not None:
+            self.task.cancelled = True
+
+    def wait(self):
+        self.pool.waitForDone()
+
+    def start_pending(self):
+        self.task = RenderTask(*self.pending)
+        self.pending = None
+        self.task.signals.finished.connect(self.finished)
+        self.pool.start(self.task)
+
+    def finished(self, generation, key, result):
+        self.task = None
+        if self.pending is not None:
+            self.start_pending()
+        if result is not None and generation > self.dropped:
+            self.rendered.emit(key, result)
+
+
+class ExportSignals(QObject):
+    progress = pyqtSignal(object, int, int)
+    finished = pyqtSignal(object, object, str)
+
+
+class ExportTask(QRunnable):
+    """Вызывает func(*args, **kwargs, progress=..., cancelled=...) в потоке из QThreadPool"""
+
+    def __init__(self, key, func, args, kwargs):
+        super().__init__()
+        self.key = key
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.signals = ExportSignals()
+        self.setAutoDelete(False)
+
+    def run(self):
+        result, error = None, ''
+        if self.cancelled:
+            self.signals.finished.emit(self.key, result, error)
+            return
+        try:
+            result = self.func(*self.args, **self.kwargs, cancelled=lambda: self.cancelled,
+                               progress=lambda done, total: self.signals.progress.emit(self.key, done, total))
+        except Exception as exception:
+            sys.excepthook(*sys.exc_info())
+            error = str(exception)
+        self.signals.finished.emit(self.key, result, error)
+
+
+class ExportWorker(QObject):
+    """Очередь экспорта: задачи выполняются по одной в порядке добавления, не занимая главный поток.
+    progress(key, сделано, всего) сообщает о ходе текущей задачи, exported(key, результат) - о
+    завершении, для отмененной задачи результат None, failed(key, сообщение) - об ошибке"""
+    progress = pyqtSignal(object, int, int)
+    exported = pyqtSignal(object, object)
+    failed = pyqtSignal(object, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.tasks = []
+
+    def submit(self, key, func, *args, **kwargs):
+        task = ExportTask(key, func, args, kwargs)
+        task.signals.progress.connect(self.progress)
+        task.signals.finished.connect(self.finished)
+        self.tasks.append(task)
+        self.pool.start(task)
+
+    def busy(self):
+        return bool(self.tasks)
+
+    def cancel(self):
+        """Отменяет текущую задачу и все ожидающие, ожидающие завершатся сразу после запуска"""
+        for task in self.tasks:
+            task.cancelled = True
+
+    def wait(self):
+        self.pool.waitForDone()
+
+    def finished(self, key, result, error):
+        # Поток один, поэтому задачи завершаются в порядке добавления
+        self.tasks.pop(0)
+        if error:
+            self.failed.emit(key, error)
+        else:
+            self.exported.emit(key, result)
+
+
+class ThumbnailSignals(QObject):
+    finished = pyqtSignal(object, object)
+
+
+class ThumbnailTask(QRunnable):
+    def __init__(self, key, func, image):
+        super().__init__()
+        self.key = key
+        self.func = func
+        self.image = image
+        self.signals = ThumbnailSignals()
+        self.setAutoDelete(False)
+
+    def run(self):
+        result = None
+        try:
+            result = self.func(self.image)
+        except Exception:
+            sys.excepthook(*sys.exc_info())
+        self.signals.finished.emit(self.key, result)
+
+
+class ThumbnailWorker(QObject):
+    """Параллельный рендер миниатюр, по задаче на миниатюру"""
+    rendered = pyqtSignal(object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(QThread.idealThreadCount())
+        self.tasks = {}
+
+    def submit(self, key, func, image):
+        """Запрашивает func(image), результат придет в сигнале rendered вместе с key"""
+        if key in self.tasks:
+            return
+        task = self.tasks[key] = ThumbnailTask(key, func, image)
+        task.signals.finished.connect(self.finished)
+        self.pool.start(task)
+
+    def wait(self):
+        self.pool.waitForDone()
+
+    def finished(self, key, image):
+        self.tasks.pop(key, None)
+        if image is not None:
+            self.rendered.emit(key, image)